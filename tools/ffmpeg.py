@@ -24,9 +24,20 @@ import os
 from os.path import dirname, join, realpath, basename
 from sys import platform
 import re
+import statistics
 import concurrent.futures
 import subprocess
+import time
 from utils.runner import *
+from utils.avworker import WorkerPool, find_libs
+from utils.cache import ResultCache, binary_id, default_cache_dir
+from utils.cpus import CpuBudget, MemoryBudget
+from utils.history import TimingDB
+from utils import proc
+from utils.shard import parse_shard, split, write_results
+from utils.store import parse_size
+from utils.refindex import RefIndex, parse_framemd5, parse_framemd5_line
+from utils.toolindex import ClipSelector
 from enum import Enum, auto
 from collections import defaultdict
 
@@ -40,6 +51,7 @@ class TestResult(Enum):
     PANIC = auto()
     FPE = auto()
     DECODE_ERR = auto()
+    SOURCE_ERR = auto()
 
 
 def print_files(name, files):
@@ -49,14 +61,18 @@ def print_files(name, files):
             print("    " + basename(f))
 
 
-def print_summary(summary, count):
-    failed = sum(
+def failed_count(count):
+    return sum(
         count[status]
         for status in count.keys()
         if status not in [TestResult.PASSED, TestResult.SKIPPED]
     )
+
+
+def print_summary(summary, count, size=lambda x: os.stat(x).st_size):
+    failed = failed_count(count)
     summary[TestResult.PASSED].sort(key=lambda x: basename(x))
-    summary[TestResult.MISMATCH].sort(key=lambda x: os.stat(x).st_size)
+    summary[TestResult.MISMATCH].sort(key=size)
     print("")
     print("+++++++++ report +++++++++")
     print_files("passed", summary[TestResult.PASSED])
@@ -67,6 +83,7 @@ def print_summary(summary, count):
     print_files("panic", summary[TestResult.PANIC])
     print_files("floating-point exception", summary[TestResult.FPE])
     print_files("decode_err", summary[TestResult.DECODE_ERR])
+    print_files("source_err", summary[TestResult.SOURCE_ERR])
     print("")
     print(
         "total = "
@@ -81,18 +98,29 @@ def print_summary(summary, count):
     print("----------")
 
 
-def get_ref_md5(fn):
-    dir = dirname(fn)
-    name = basename(fn)
-    checksums_path = os.path.join(dir, "md5.txt")
-    try:
-        with open(checksums_path) as checksums_file:
-            checksums = checksums_file.readlines()
-        checksums = filter(lambda l: l.endswith("  " + name + "\n"), checksums)
-        checksum = next(checksums)
-        return checksum.split()[0]
-    except (FileNotFoundError, StopIteration):
-        return None
+def print_usage(usage, n):
+    if not usage or n <= 0:
+        return
+    def table(name, key):
+        print(name + ":")
+        print("    %-60s %9s %9s %9s %10s %8s %8s" % ("clip", "wall(s)", "user(s)", "sys(s)", "rss(MiB)", "nvcsw", "nivcsw"))
+        for f in sorted(usage, key=lambda f: -usage[f][key])[:n]:
+            u = usage[f]
+            print("    %-60s %9.2f %9.2f %9.2f %10.1f %8d %8d" % (basename(f), u["wall"], u["user"], u["sys"],
+                  u["maxrss_kb"] / 1024, u["nvcsw"], u["nivcsw"]))
+    table("slowest", "wall")
+    table("largest memory", "maxrss_kb")
+    print("----------")
+
+
+def first_frame_mismatch(refframes, frames):
+    # (index, pts) of the first frame that differs from the reference, None if all match
+    for i, frame in enumerate(frames):
+        if i >= len(refframes) or frame[1] != refframes[i][1]:
+            return i, frame[0]
+    if len(frames) < len(refframes):
+        return len(frames), None
+    return None
 
 
 class ConformanceRunner(TestRunner):
@@ -103,10 +131,45 @@ class ConformanceRunner(TestRunner):
         summary = defaultdict(list)
         count = defaultdict(int)
 
+        self.__cache = None
+        if not self.args.no_cache:
+            self.__cache = ResultCache(self.args.cache_dir, self.args.cache_size)
+            self.__ffmpeg_id = binary_id(self.args.ffmpeg_path)
+
+        self.__timings = TimingDB(os.path.join(self.args.cache_dir, "timings.json"))
+        self.__budget = CpuBudget(self.args.cpus)
+        self.__memory = MemoryBudget(parse_size(self.args.max_memory)) if self.args.max_memory else None
+        self.__usage = {}
+
+        self.__workers = None
+        if self.args.batch:
+            libs = find_libs(self.args.ffmpeg_path)
+            if not libs:
+                raise Exception("--batch needs an ffmpeg linked against shared libavutil, libavcodec and libavformat")
+            self.__workers = WorkerPool(libs, self.args.threads)
+
+        selector = ClipSelector.from_args(self.args, self.args.cache_dir)
+        shard = None
+        file_list = self.args.test_path
+        if self.args.shard:
+            # split before anything is fetched, each shard only downloads and verifies its own sources
+            shard = parse_shard(self.args.shard)
+            clips = self.list_clips(self.args.test_path)
+            file_list = split(clips, shard[1], self.__shard_cost(clips))[shard[0] - 1]
+        # clips are decoded as soon as they are downloaded and verified
+        file_list = self.stream_files(file_list, self.args.download_jobs, self.args.verify_jobs, key=self.__longest_first)
+        if selector:
+            file_list = selector.select(file_list)
+        if not self.args.no_output_check:
+            self.__refs = RefIndex().load(self.args.test_path)
+
+        self.__source_errors = []
         with concurrent.futures.ThreadPoolExecutor(
             max_workers=self.args.threads
         ) as executor:
-            future_to_file = self.__submmit_files(executor, self.args.test_path)
+            future_to_file = self.__submmit_files(executor, file_list)
+            if not self.args.no_output_check:
+                self.__refs.report(list(future_to_file.values()))
             for future in concurrent.futures.as_completed(future_to_file):
                 f = future_to_file[future]
                 try:
@@ -116,24 +179,50 @@ class ConformanceRunner(TestRunner):
                 else:
                     count[s] += 1
                     summary[s].append(f)
+        for f in self.__source_errors:
+            count[TestResult.SOURCE_ERR] += 1
+            summary[TestResult.SOURCE_ERR].append(f)
 
+        if self.__workers:
+            self.__workers.close()
+        if self.__cache:
+            self.__cache.save()
+        self.__timings.save()
+        self.save_md5s()
+        if self.args.json_out:
+            write_results(self.args.json_out, shard, [(f, s.name) for s in summary for f in summary[s]], self.__usage)
         print_summary(summary, count)
-        sys.exit(sum(count[status]
-            for status in count.keys()
-            if status not in [TestResult.PASSED, TestResult.SKIPPED]
-        ))
+        print_usage(self.__usage, self.args.top)
+        sys.exit(failed_count(count))
 
     def add_args(self, parser):
-        parser.add_argument("-t", "--threads", type=int, default=16)
+        parser.add_argument("-t", "--threads", type=int, default=16, help="max number of concurrent decodes")
+        parser.add_argument("--cpus", type=int, default=None, help="cores shared by all decodes, defaults to all logical CPUs")
+        parser.add_argument("--pin", action="store_true", help="pin every decode to the cores it was given")
+        parser.add_argument("--max-memory", type=str, default=None,
+                            help="e.g. 16G, hold decodes back while their expected peak memory would add up to more")
+        parser.add_argument("--max-timeout", type=float, default=30 * 60, help="seconds, the longest any clip may take")
         parser.add_argument("--allow-decode-error", action="store_true")
         parser.add_argument("--no-output-check", action="store_true")
+        parser.add_argument("--no-cache", action="store_true", help="always decode, ignore and do not update the result cache")
+        parser.add_argument("--cache-dir", type=str, default=default_cache_dir())
+        parser.add_argument("--cache-size", type=int, default=20000, help="max number of cached results")
+        parser.add_argument("--shard", type=str, default=None, help="K/N, run the K-th of N parts of test_path, balanced by expected cost")
+        parser.add_argument("--json-out", type=str, default=None, help="also write the results to this file, see merge_results.py")
+        parser.add_argument("--top", type=int, default=10, help="number of clips in the slowest and largest memory tables")
+        parser.add_argument("--batch", action="store_true",
+                            help="decode in long-lived workers using ffmpeg's own libavcodec instead of one ffmpeg per clip, "
+                                 "for corpora of small clips. failures and crashes are rechecked with ffmpeg")
+        ClipSelector.add_args(parser)
+        parser.add_argument("--frame-check", action="store_true", help="compare per-frame md5s while decoding and stop at the first bad frame, for clips with a framemd5 reference")
 
-    def __ffmpeg_cmd(self, input_stream):
+    def __ffmpeg_cmd(self, input_stream, muxer="md5", threads=None):
         return (
             self.args.ffmpeg_path
+            + (" -threads " + str(threads) if threads else "")
             + " -strict -2 -f vvc -i "
             + input_stream
-            + " -vsync 0 -noautoscale -an -map 0:v:0 -f md5 -"
+            + " -vsync 0 -noautoscale -an -map 0:v:0 -f " + muxer + " -"
         )
 
     @staticmethod
@@ -151,29 +240,39 @@ class ConformanceRunner(TestRunner):
     def __test(self, f):
         print(basename(f), end="")
 
+        refframes = None
         if not self.args.no_output_check:
-            refmd5 = get_ref_md5(f)
+            refmd5 = self.__refs.get(f)
             if not refmd5:
                 print(" has no ref md5")
                 return TestResult.SKIPPED
+            if self.args.frame_check:
+                refframes = self.__refs.get_frames(f)
 
-        cmd = self.__ffmpeg_cmd(f)
         try:
-            process = subprocess.run(cmd.split(), capture_output=True, timeout=30 * 60)
+            returncode, stdout, mismatch = self.__decode(f, refframes)
         except subprocess.TimeoutExpired:
             print(" timed out")
             return TestResult.TIMEOUT
 
-        if process.returncode != 0:
-            if self.args.allow_decode_error and process.returncode > 0:
+        if mismatch:
+            index, pts = mismatch
+            if pts is None:
+                print(" frame mismatch. Output stopped at frame %d of %d" % (index, len(refframes)))
+            else:
+                print(" frame mismatch. First bad frame = %d, pts = %d" % (index, pts))
+            return TestResult.MISMATCH
+
+        if returncode != 0:
+            if self.args.allow_decode_error and returncode > 0:
                 print(" passed")
                 return TestResult.PASSED
             else:
                 print(" failed")
-                return self.__returncode_err(process.returncode)
+                return self.__returncode_err(returncode)
 
-        if not self.args.no_output_check:
-            md5 = process.stdout.decode().replace("MD5=", "").strip()
+        if not self.args.no_output_check and refframes is None:
+            md5 = stdout.replace("MD5=", "").strip()
             if refmd5 != md5:
                 print(" MD5 mismatch. Ref MD5 = " + refmd5 + ", decoded MD5 = " + md5)
                 return TestResult.MISMATCH
@@ -181,14 +280,151 @@ class ConformanceRunner(TestRunner):
         print(" passed")
         return TestResult.PASSED
 
-    def __submmit_files(self, executor, path):
+    def __decode(self, f, refframes=None):
+        muxer = "md5" if refframes is None else "framemd5"
+        key = None
+        if self.__cache:
+            # the input path is covered by the content hash, keep it out of the key so moved clips still hit.
+            # so is the thread count, the output must not depend on it and it varies with the host
+            key = ResultCache.key(self.__ffmpeg_id, self.get_md5(f), self.__ffmpeg_cmd("{input}", muxer))
+            cached = self.__cache.get(key)
+            if cached:
+                print(" (cached)", end="")
+                stdout = cached["stdout"]
+                mismatch = None if refframes is None else first_frame_mismatch(refframes, parse_framemd5(stdout))
+                return cached["returncode"], stdout, mismatch
+
+        if self.__workers and refframes is None:
+            decoded = self.__decode_batch(f, key)
+            if decoded:
+                return decoded
+
+        timeout = self.__timeout(f)
+        cpus, memory = self.__acquire(f)
+        cmd = self.__ffmpeg_cmd(f, muxer, len(cpus))
+        pinned = cpus if self.args.pin else None
+        start = time.monotonic()
+        try:
+            if refframes is None:
+                returncode, stdout, _, usage = proc.run(cmd.split(), timeout, pinned)
+                stdout, mismatch = stdout.decode(), None
+            else:
+                returncode, stdout, mismatch, usage = self.__decode_frames(cmd, refframes, timeout, pinned)
+        except subprocess.TimeoutExpired:
+            self.__timings.record(f, time.monotonic() - start, fit=False)
+            raise
+        finally:
+            self.__release(cpus, memory)
+        # an aborted decode says nothing about the frames after the bad one, nor about its runtime
+        aborted = mismatch is not None and mismatch[1] is not None
+        if not aborted:
+            self.__timings.record(f, time.monotonic() - start, usage["maxrss_kb"] * 1024 if usage else None)
+        if usage:
+            self.__usage[f] = usage
+        if key and not aborted:
+            self.__cache.put(key, {"returncode": returncode, "stdout": stdout})
+        return returncode, stdout, mismatch
+
+    def __decode_batch(self, f, key):
+        # only clean results are taken from the worker, anything else is left to the per-process decode,
+        # which reproduces ffmpeg's exit codes and pins a crash on this clip alone
+        timeout = self.__timeout(f)
+        cpus, memory = self.__acquire(f)
+        start = time.monotonic()
+        try:
+            returncode, stdout = self.__workers.decode(f, len(cpus), timeout, cpus if self.args.pin else None)
+        except subprocess.TimeoutExpired:
+            # the per-process decode gets the same timeout and records it if it hangs there too
+            return None
+        finally:
+            self.__release(cpus, memory)
+        if returncode is None or returncode < 0:
+            return None
+        if returncode == 0:
+            if not self.args.no_output_check and stdout.replace("MD5=", "").strip() != self.__refs.get(f):
+                return None
+            self.__timings.record(f, time.monotonic() - start)
+            if key:
+                self.__cache.put(key, {"returncode": returncode, "stdout": stdout})
+            return returncode, stdout, None
+        if self.args.allow_decode_error:
+            self.__timings.record(f, time.monotonic() - start)
+            return returncode, stdout, None
+        return None
+
+    def __timeout(self, f):
+        return self.__timings.timeout(f, self.args.timeout_scale, self.args.min_timeout, self.args.max_timeout)
+
+    def __acquire(self, f):
+        # memory first, so a decode waiting for it does not sit on cores
+        memory = self.__memory.acquire(self.__timings.memory(f)) if self.__memory else 0
+        cpus = self.__budget.acquire(self.__budget.cores_for(f, self.__timings.resolution(f)))
+        return cpus, memory
+
+    def __release(self, cpus, memory):
+        self.__budget.release(cpus)
+        if self.__memory:
+            self.__memory.release(memory)
+
+    @staticmethod
+    def __decode_frames(cmd, refframes, timeout, cpus=None):
+        start = time.monotonic()
+        process = proc.popen(cmd.split(), cpus, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        watchdog = proc.Watchdog(process, timeout)
+
+        lines = []
+        frames = []
+        mismatch = None
+        try:
+            for line in process.stdout:
+                line = line.decode()
+                lines.append(line)
+                frame = parse_framemd5_line(line)
+                if not frame:
+                    continue
+                i = len(frames)
+                frames.append(frame)
+                if i >= len(refframes) or frame[1] != refframes[i][1]:
+                    mismatch = i, frame[0]
+                    proc.kill(process)
+                    break
+            returncode, usage = proc.wait(process, start)
+        finally:
+            watchdog.cancel()
+            process.stdout.close()
+
+        if watchdog.fired.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if not mismatch and returncode == 0:
+            mismatch = first_frame_mismatch(refframes, frames)
+        return returncode, "".join(lines), mismatch, usage
+
+    def __submmit_files(self, executor, file_list):
         future_to_file = {}
-        file_list = sorted(self.list_files(path), key=lambda x: os.stat(x).st_size)
-        for f in file_list:
-            future_to_file[executor.submit(self.__test, f)] = f
+        # longest expected first, so the slow clips overlap with the short ones instead of trailing them,
+        # stream_files() does the same for every batch of clips that become usable together
+        if isinstance(file_list, list):
+            file_list = sorted(file_list, key=self.__longest_first)
+        try:
+            for f in file_list:
+                future_to_file[executor.submit(self.__test, f)] = f
+        except SourceError as e:
+            # the clips submitted so far still run, and are reported and cached as usual
+            print(e)
+            self.__source_errors.append(e.path)
 
         return future_to_file
 
+    def __shard_cost(self, clips):
+        # the same on every shard: the header model for files in the tree, and a uniform cost for
+        # sources, which may not be on disk yet, the median of the others
+        costs = {f: self.__timings.static_cost(f) for f in clips if not f.endswith(".yaml")}
+        uniform = statistics.median(costs.values()) if costs else 1.0
+        return lambda f: costs.get(f, uniform)
+
+    def __longest_first(self, f):
+        return -self.__timings.estimate(f), f
+
 
 if __name__ == "__main__":
     t = ConformanceRunner()
@@ -1,17 +1,75 @@
 import hashlib
 import argparse
+import concurrent.futures
 import time
 import os
 import zipfile
 import subprocess
 import shutil
+import tempfile
+import threading
+from utils.refindex import RefIndex, FRAMEMD5_DIR, FRAMEMD5_EXT
+
+CHUNK_SIZE = 1 << 20
+
+def get_stream_md5(f):
+    # returns (md5, size), never holds more than one chunk
+    md5 = hashlib.md5()
+    size = 0
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        md5.update(chunk)
+        size += len(chunk)
+    return md5.hexdigest(), size
 
 def get_file_md5(path):
     with open(path, 'rb') as f:
-        data = f.read()
-        file_md5 = hashlib.md5(data).hexdigest()
-        return file_md5
-    return ''
+        return get_stream_md5(f)[0]
+
+def get_ffmpeg_md5(ffmpeg, bit_path, framemd5_path=None):
+    # the md5 muxer hashes rawvideo packets, the same bytes ffmpeg would write to a .yuv
+    cmd = [ffmpeg, '-strict', '-2', '-f', 'vvc', '-i', bit_path, '-vsync', '0', '-noautoscale', '-an', '-map', '0:v:0', '-f', 'md5', '-']
+    if framemd5_path:
+        # second output of the same decode, per-frame references for ffmpeg.py --frame-check
+        cmd += ['-vsync', '0', '-noautoscale', '-an', '-map', '0:v:0', '-f', 'framemd5', '-y', framemd5_path]
+    o = subprocess.run(cmd, stdout=subprocess.PIPE)
+    md5 = o.stdout.decode().replace('MD5=', '').strip()
+    return md5 if md5 else None
+
+def get_vvdec_md5(vvdec, bit_path):
+    # vvdec only writes to a file name, give it a fifo and hash what comes out
+    if not hasattr(os, 'mkfifo'):
+        return get_vvdec_md5_file(vvdec, bit_path)
+
+    with tempfile.TemporaryDirectory() as dir:
+        fifo = os.path.join(dir, 'out.yuv')
+        os.mkfifo(fifo)
+        # both ends are opened here, before vvdec runs: the reader never waits in open(), and our
+        # write end keeps it from seeing eof before vvdec has opened the fifo, or if vvdec never does
+        rfd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+        os.set_blocking(rfd, True)
+        wfd = os.open(fifo, os.O_WRONLY)
+        result = [None, 0]
+        def reader():
+            with os.fdopen(rfd, 'rb') as f:
+                result[0], result[1] = get_stream_md5(f)
+        t = threading.Thread(target=reader)
+        t.start()
+        try:
+            subprocess.run([vvdec, '-b', bit_path, '-o', fifo])
+        finally:
+            os.close(wfd)
+        t.join()
+    return result[0] if result[1] else None
+
+def get_vvdec_md5_file(vvdec, bit_path):
+    yuv = bit_path + '_a.yuv'
+    subprocess.run('%s -b "%s" -o "%s"' % (vvdec, bit_path, yuv))
+    try:
+        md5 = get_file_md5(yuv) if os.stat(yuv).st_size != 0 else None
+        os.remove(yuv)
+    except FileNotFoundError:
+        md5 = None
+    return md5
 
 def list_files(dir):
     files = []
@@ -21,15 +79,6 @@ def list_files(dir):
             files.append(os.path.join(path, f))
     return files
 
-def remove_dir(dir):
-    paths = os.walk(dir)
-    for path, dir_lst, file_lst in paths:
-        for f in file_lst:
-            os.remove(os.path.join(dir, f))
-        for d in dir_lst:
-            remove_dir(os.path.join(dir, d))
-    os.rmdir(dir)
-
 class MD5Runner():
     def __init__(self) -> None:
         parser = argparse.ArgumentParser(description='md5 generator')
@@ -38,6 +87,8 @@ class MD5Runner():
         parser.add_argument('--clips',             type=str, required=True,  default=None, help='path to vtm clips'      )
         parser.add_argument('--failure_path',      type=str, required=True,  default=None, help='the destination path when the md5 is not match between ffmpeg and vvdec')
         parser.add_argument('--conformance_path',  type=str, required=True,  default=None, help='the destination path when the md5 is match between ffmpeg and vvdec'    )
+        parser.add_argument('--framemd5',          action='store_true',                     help='also write per-frame references to framemd5/ in the conformance path')
+        parser.add_argument('-j', '--jobs',        type=int, required=False, default=os.cpu_count(), help='number of clips decoded in parallel')
         self.args = parser.parse_args()
 
         self.failed_path = ['conformance/failed/v1', 'conformance/failed/v2']
@@ -45,6 +96,7 @@ class MD5Runner():
 
         self.failed = []
         self.passed = []
+        self.refs = RefIndex()
 
         for p in self.failed_path:
             self.failed.append(self.read_md5(p))
@@ -54,14 +106,11 @@ class MD5Runner():
         pass
 
     def read_md5(self, path):
-        path = os.path.join(os.path.abspath(__file__), '../../' + path)
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', path)
+        self.refs.load(path)
         md5_list = {}
-        with open(os.path.join(path, 'md5.txt'), 'r+') as f:
-            for line in f.readlines():
-                pair = line.replace('\n', '').split('  ')
-                if len(pair) == 2:
-                    md5, name = pair
-                    md5_list[name] = { 'md5': md5, 'fmd5': None, 'entity': False }
+        for name, md5 in self.refs.entries(path).items():
+            md5_list[name] = { 'md5': md5, 'fmd5': None, 'entity': False }
 
         files = list_files(path)
         for file in files:
@@ -69,7 +118,7 @@ class MD5Runner():
             if name == 'md5.txt':
                 continue
             if not name in md5_list:
-                md5_list[name] = { 'md5': None, 'fmd5': None }
+                md5_list[name] = { 'md5': None, 'fmd5': None, 'entity': False }
             md5_list[name]['fmd5']   = get_file_md5(file)
             md5_list[name]['entity'] = True
 
@@ -91,11 +140,84 @@ class MD5Runner():
 
         return False
 
+    def gen_clip(self, clip):
+        file = os.path.basename(clip)
+        file_name, file_ext = os.path.splitext(file)
+        tmp_clip_path = os.path.join(self.tmp_path, file)
+        os.mkdir(tmp_clip_path)
+
+        bit_path = ''
+        bit_member = None
+        vtm_md5 = None
+        ref_md5 = None
+        with zipfile.ZipFile(clip) as zip_file:
+            for name in zip_file.namelist():
+                root, extension = os.path.splitext(name)
+                if 'yuv.md5' in name and not 'first_picture.yuv.md5' in name:
+                    line = zip_file.read(name)
+                    pair = line.decode('utf-8').replace('\r', '').replace('\n', '').split(' ')
+                    if len(pair) > 0:
+                        ref_md5 = pair[0].lower()
+
+                if extension == '.bit':
+                    # the decoders need a real file, this is the only thing written to tmp
+                    bit_member = name
+                    bit_path = os.path.join(tmp_clip_path, name)
+                    zip_file.extract(name, tmp_clip_path)
+
+            with zip_file.open(bit_member) as f:
+                bit_md5 = get_stream_md5(f)[0]
+
+        if self.args.vvdec != None:
+            vtm_md5 = get_vvdec_md5(self.args.vvdec, bit_path)
+
+        if vtm_md5 == None:
+            vtm_md5 = ref_md5
+
+        framemd5_path = None
+        if self.args.framemd5:
+            framemd5_path = os.path.join(self.tmp_path, file_name + '.bit' + FRAMEMD5_EXT)
+        ffmpeg_md5 = get_ffmpeg_md5(self.args.ffmpeg, bit_path, framemd5_path)
+        shutil.rmtree(tmp_clip_path)
+
+        return {
+            'clip': clip, 'bit_member': bit_member, 'bit_name': file_name + '.bit', 'bit_md5': bit_md5,
+            'vtm_md5': vtm_md5, 'ffmpeg_md5': ffmpeg_md5, 'framemd5_path': framemd5_path,
+        }
+
+    def merge_clip(self, r):
+        bit_name = r['bit_name']
+        vtm_md5 = r['vtm_md5']
+        ffmpeg_md5 = r['ffmpeg_md5']
+
+        # no md5 on either side means a decode failed, that is never a pass
+        if vtm_md5 == None or ffmpeg_md5 == None or vtm_md5 != ffmpeg_md5:
+            print("%s: md5(%s, %s) is not match" % (r['clip'], vtm_md5, ffmpeg_md5))
+            if not self.check_clip_exist(self.failed, vtm_md5, bit_name, r['bit_md5']):
+                self.copy_bit(r, self.args.failure_path)
+        else:
+            if not self.check_clip_exist(self.passed, vtm_md5, bit_name, r['bit_md5']):
+                self.copy_bit(r, self.args.conformance_path)
+            # only a matching decode is trusted as a per-frame reference
+            if r['framemd5_path'] and vtm_md5 != None and os.path.exists(r['framemd5_path']):
+                dir = os.path.join(self.args.conformance_path, FRAMEMD5_DIR)
+                os.makedirs(dir, exist_ok=True)
+                shutil.move(r['framemd5_path'], os.path.join(dir, bit_name + FRAMEMD5_EXT))
+
+        if vtm_md5 != None:
+            self.md5_list.append((bit_name, vtm_md5))
+
+    @staticmethod
+    def copy_bit(r, dir):
+        with zipfile.ZipFile(r['clip']) as zip_file:
+            with zip_file.open(r['bit_member']) as src, open(os.path.join(dir, r['bit_name']), 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
     def run(self):
         self.md5_list = []
         self.tmp_path = 'tmp'
         if os.path.exists(self.tmp_path):
-            remove_dir(self.tmp_path)
+            shutil.rmtree(self.tmp_path)
         os.mkdir(self.tmp_path)
 
         if not os.path.exists(self.args.failure_path):
@@ -104,59 +226,11 @@ class MD5Runner():
         if not os.path.exists(self.args.conformance_path):
             os.mkdir(self.args.conformance_path)
 
-        paths = os.walk(self.args.clips)
-        for path, dir_lst, file_lst in paths:
-            for file in file_lst:
-                file_name, file_ext = os.path.splitext(file)
-                bit_name = file_name + '.bit'
-
-                tmp_clip_path = os.path.join(self.tmp_path, file)
-                os.mkdir(tmp_clip_path)
-                clip = os.path.join(path, file)
-
-                bit_path = ''
-                md5_path = None
-                zip_file = zipfile.ZipFile(clip)
-                for name in zip_file.namelist():
-                    root, extension = os.path.splitext(name)
-                    if 'yuv.md5' in name and not 'first_picture.yuv.md5' in name:
-                        md5_path = os.path.join(tmp_clip_path, name)
-                        zip_file.extract(name, tmp_clip_path)
-
-                    if extension == '.bit':
-                        bit_path = os.path.join(tmp_clip_path, name)
-                        zip_file.extract(name, tmp_clip_path)
-
-                yuv_a = bit_path + '_a.yuv'
-                yuv_b = bit_path + '_b.yuv'
-
-                vtm_md5 = None
-                if self.args.vvdec != None:
-                    subprocess.run('%s -b "%s" -o "%s"' % (self.args.vvdec, bit_path, yuv_a))
-                    stats = os.stat(yuv_a)
-                    if stats.st_size != 0:
-                        vtm_md5 = get_file_md5(yuv_a)
-
-                if vtm_md5 == None and md5_path != None:
-                    with open(md5_path, 'rb+') as f:
-                        line = f.read()
-                        pair = line.decode('utf-8').replace('\r', '').replace('\n', '').split(' ')
-                        if len(pair) > 0:
-                            vtm_md5 = pair[0].lower()
-
-                subprocess.run('%s -strict -2 -i "%s" -noautoscale "%s"' % (self.args.ffmpeg, bit_path, yuv_b))
-                ffmpeg_md5 = get_file_md5(yuv_b)
-
-                if vtm_md5 != ffmpeg_md5:
-                    print("%s: md5(%s, %s) is not match" % (bit_path, vtm_md5, ffmpeg_md5))
-                    if not self.check_clip_exist(self.failed, vtm_md5, bit_name, get_file_md5(bit_path)):
-                        shutil.copy(bit_path, os.path.join(self.args.failure_path, bit_name))
-                else:
-                    if not self.check_clip_exist(self.passed, vtm_md5, bit_name, get_file_md5(bit_path)):
-                        shutil.copy(bit_path, os.path.join(self.args.conformance_path, bit_name))
-
-                if vtm_md5 != None:
-                    self.md5_list.append((bit_name, vtm_md5))
+        # clips finish in any order, results are merged in path order so md5.txt and the copies are reproducible
+        clips = sorted(list_files(self.args.clips))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.args.jobs) as executor:
+            for r in executor.map(self.gen_clip, clips):
+                self.merge_clip(r)
 
         self.write_md5_txt(self.args.failure_path)
         self.write_md5_txt(self.args.conformance_path)
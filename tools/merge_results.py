@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import argparse
+import sys
+from collections import defaultdict
+from ffmpeg import TestResult, failed_count, print_summary, print_usage
+from utils.shard import read_results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="merge ffmpeg.py --shard K/N --json-out results")
+    parser.add_argument("results", type=str, nargs="+")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    summary = defaultdict(list)
+    count = defaultdict(int)
+    sizes = {}
+    usage = {}
+    for r in read_results(args.results):
+        s = TestResult[r["status"]]
+        count[s] += 1
+        summary[s].append(r["file"])
+        sizes[r["file"]] = r["size"]
+        if "usage" in r:
+            usage[r["file"]] = r["usage"]
+
+    print_summary(summary, count, size=lambda x: sizes[x])
+    print_usage(usage, args.top)
+    sys.exit(failed_count(count))
@@ -20,58 +20,296 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import random
 import statistics
 import subprocess
+import sys
 from utils.runner import *
 from utils.perfapp import *
+from utils.cache import default_cache_dir
+from utils.cpus import logical_cpus
+from utils.history import BenchHistory, TimingDB
+from utils.host import host_id
+from utils import perfstat
+from utils import proc
+from utils import latency
+from utils.framerate import clip_frame_rate, realtime
+from utils.benchenv import BenchEnv
+from utils.measure import Measurement, summarize, mann_whitney_p, ratio_ci, geomean
 
 class PerformanceRunner(TestRunner):
     __summary = {}
     __app = None
     def run(self):
-        self.__app = self.__get_app()
+        self.__app = get_app(self.args)
+        if self.args.latency and not hasattr(self.__app, "get_latency_cmd"):
+            raise Exception("--latency needs ffmpeg, %s can not report per-frame output" % self.__app.get_path())
+        self.__measurement = Measurement.from_args(self.args)
+        self.__env = BenchEnv(self.args)
+        self.__host = self.__env.setup()
+        # ffmpeg.py's timing history and header cost model, for the timeouts
+        self.__timings = TimingDB(os.path.join(default_cache_dir(), "timings.json"))
+        self.__perf_stat = None
+        self.__counters = {}
+        if self.args.perf_stat:
+            if not perfstat.available():
+                raise Exception("--perf-stat needs the linux perf tool in PATH")
+            self.__perf_stat = perfstat.PerfStat()
 
-        files = self.list_files(self.args.test_path)
-        for f in files:
-            self.__test(f)
+        if self.args.stream:
+            files = self.stream_files(self.args.test_path, self.args.download_jobs, self.args.verify_jobs)
+        else:
+            files = self.list_files(self.args.test_path)
+        if self.args.latency:
+            self.__each(files, self.__test_latency)
+            self.__print_latency_summary()
+            return
+
+        if self.args.backend:
+            apps = [create_app(b) for b in self.args.backend]
+            self.__each(files, self.__test_matrix, apps)
+            self.__print_matrix_summary(apps)
+            return
+
+        if len(self.args.ffmpeg_paths) > 1:
+            apps = [FFmpegApp(p) for p in self.args.ffmpeg_paths]
+            self.__each(files, self.__test_ab, apps)
+            self.__print_ab_summary()
+            return
+
+        self.__each(files, self.__test)
 
         self.__print_summary()
+        regressions = self.__record_history()
+        sys.exit(regressions)
 
     def add_args(self, parser):
         parser.add_argument("--vvdec-path", type=str)
+        Measurement.add_args(parser)
+        BenchEnv.add_args(parser)
+        parser.add_argument("--stream", action="store_true",
+                            help="start timing while the rest of the clips download, the downloads then compete with the decoder")
+        parser.add_argument("--history", type=str, default=os.path.join(default_cache_dir(), "bench.jsonl"), help="benchmark history file")
+        parser.add_argument("--no-history", action="store_true", help="do not record this run")
+        parser.add_argument("--compare-to", type=str, default=None,
+                            help="flag clips slower than the history, 'recent' for any decoder or a decoder hash prefix / version substring")
+        parser.add_argument("--history-window", type=int, default=10)
+        parser.add_argument("--realtime", action="store_true", help="report decode speed relative to each clip's frame rate")
+        parser.add_argument("--rt-margin", type=float, default=0.2, help="required headroom over real time")
+        parser.add_argument("--backend", type=str, action="append", default=[],
+                            help="[label=]kind:path[@extra args], repeat for a clip x backend x threads matrix, kinds: " + ", ".join(sorted(BACKENDS)))
+        parser.add_argument("--matrix-threads", type=str, default="0", help="comma separated thread counts for --backend, 0 is the decoder default")
+        parser.add_argument("--reference", type=str, default=None, help="backend label the matrix is normalised to, defaults to the first")
+        parser.add_argument("--latency", action="store_true", help="measure per-frame output intervals instead of throughput, ffmpeg only")
+        parser.add_argument("--latency-threads", type=str, default="0", help="comma separated thread counts for --latency, 0 is the decoder default")
+        parser.add_argument("--perf-stat", action="store_true", help="also collect hardware counters with linux perf stat")
+
+    def __each(self, files, test, *args):
+        self.__env.each(files, self.__skip_timeout, test, *args)
+
+    def __skip_timeout(self, test, *args):
+        # a hung or far too slow clip is left out, the rest of the run goes on
+        try:
+            test(*args)
+        except subprocess.TimeoutExpired as e:
+            fn = os.path.basename(args[-1])
+            print("%s timed out after %.0f s, skipped" % (fn, e.timeout))
+            self.__summary.pop(fn, None)
+            self.__counters.pop(fn, None)
 
-    def __get_app(self):
-        if self.args.vvdec_path:
-            return VVDecApp(self.args.vvdec_path)
-        return FFmpegApp(self.args.ffmpeg_path)
+    def __timeout(self, input, app=None):
+        scale = self.args.timeout_scale * (app or self.__app).timeout_scale(len(logical_cpus()))
+        return self.__timings.timeout(input, scale, self.args.min_timeout, 5 * 60)
 
     def __test(self, input):
         fn = os.path.basename(input)
-        self.__summary[fn] = []
-        fps = self.__summary[fn]
         cmd = self.__app.get_cmd(input)
         print(cmd)
-        for i in range(0, 3):
-            try:
-                o = subprocess.run(cmd.split(), capture_output=True, timeout=5 * 60)
-                if o.returncode:
-                    raise Exception(o.stderr)
-                o = self.__app.get_fps(o)
-                print("fps = ", o)
-                fps.append(o)
-            except Exception as e:
-                print(e)
-                raise
+        counters = []
+        frames = []
+        def run_cmd(argv):
+            # perf stat forks the decoder, on a timeout both have to go
+            returncode, stdout, stderr, _ = proc.run(argv, self.__timeout(input), group=bool(self.__perf_stat))
+            return subprocess.CompletedProcess(argv, returncode, stdout, stderr)
+        def run_once():
+            if self.__perf_stat:
+                o, c = self.__perf_stat.run(run_cmd, cmd.split())
+                counters.append(c)
+            else:
+                o = run_cmd(cmd.split())
+            if o.returncode:
+                raise Exception(o.stderr)
+            frames.append(self.__app.get_frames(o))
+            o = self.__app.get_fps(o)
+            print("fps = ", o)
+            return o
+        self.__summary[fn] = self.__measurement.run(run_once)
+        if counters:
+            # warm-up runs are counted too, instruction counts barely move between runs
+            self.__counters[fn] = perfstat.summarize(counters, frames[-1])
+
+    def __test_matrix(self, apps, input):
+        fn = os.path.basename(input)
+        self.__summary[fn] = {}
+        for threads in [int(x) for x in self.args.matrix_threads.split(",")]:
+            for app in apps:
+                app.set_threads(threads)
+                print(app.label, app.get_cmd(input))
+                self.__summary[fn][(app.label, threads)] = self.__measurement.run(lambda: self.__run_app(app, input))
+
+    def __print_matrix_summary(self, apps):
+        labels = [app.label for app in apps]
+        ref = self.args.reference or labels[0]
+        if ref not in labels:
+            raise Exception("--reference %s is not one of the backends: %s" % (ref, ", ".join(labels)))
+        threads = [int(x) for x in self.args.matrix_threads.split(",")]
+        print("relative speed, %s = 1.00" % ref)
+        print("clip | threads | " + " | ".join(labels) + " |")
+        rel = {l: [] for l in labels}
+        for k, v in self.__summary.items():
+            for t in threads:
+                base = v[(ref, t)]["median"]
+                cells = []
+                for l in labels:
+                    r = v[(l, t)]["median"] / base
+                    rel[l].append(r)
+                    cells.append("%.1f fps (%.2f)" % (v[(l, t)]["median"], r))
+                print(k, "|", t if t else "default", "|", " | ".join(cells), "|")
+        print("geomean | | " + " | ".join("%.2f" % geomean(rel[l]) for l in labels) + " |")
+
+    def __test_latency(self, input):
+        fn = os.path.basename(input)
+        self.__summary[fn] = {}
+        for threads in [int(x) for x in self.args.latency_threads.split(",")]:
+            self.__app.set_threads(threads)
+            cmd = self.__app.get_latency_cmd(input)
+            print(cmd)
+            for i in range(self.__measurement.warmup):
+                latency.frame_times(cmd.split(), self.__timeout(input))
+            runs = [latency.frame_times(cmd.split(), self.__timeout(input)) for i in range(self.__measurement.min_runs)]
+            self.__summary[fn][threads] = latency.summarize(runs)
+
+    def __print_latency_summary(self):
+        print("clip | threads | frames | time to first frame (ms) | p50 (ms) | p95 (ms) | p99 (ms) | max (ms) | runs |")
+        for k, v in self.__summary.items():
+            for threads, s in v.items():
+                def ms(key):
+                    return "%.1f" % (s[key] * 1000) if key in s else "-"
+                print(k, "|", threads if threads else "default", "|", s["frames"], "|", ms("ttff"), "|", ms("p50"), "|",
+                      ms("p95"), "|", ms("p99"), "|", ms("max"), "|", s["runs"], "|")
+
+    def __run_app(self, app, input):
+        o = subprocess.run(app.get_cmd(input).split(), capture_output=True, timeout=self.__timeout(input, app))
+        if o.returncode:
+            raise Exception(o.stderr)
+        return app.get_fps(o)
+
+    def __test_ab(self, apps, input):
+        # one run of every binary per round, in a fresh random order, so drift and noise hit all of them alike
+        fn = os.path.basename(input)
+        m = self.__measurement
+        rng = random.Random(fn)
+        for i in range(m.warmup):
+            for app in apps:
+                self.__run_app(app, input)
+        samples = [[] for app in apps]
+        while True:
+            order = list(range(len(apps)))
+            rng.shuffle(order)
+            for i in order:
+                samples[i].append(self.__run_app(apps[i], input))
+            print(fn, "round", len(samples[0]), ["%.1f" % v[-1] for v in samples])
+            n = len(samples[0])
+            if n < m.min_runs:
+                continue
+            stats = [summarize(v, m.confidence) for v in samples]
+            if all(m.converged(x) for x in stats) or n >= m.max_runs:
+                break
+        self.__summary[fn] = stats
+
+    def __print_ab_summary(self):
+        paths = self.args.ffmpeg_paths
+        for i, p in enumerate(paths):
+            print("%s: %s" % (chr(ord("A") + i), p))
+        speedups = [[] for p in paths]
+        print("clip | binary | median fps | speedup | %d%% CI | p |" % round(self.__measurement.confidence * 100))
+        for k, stats in self.__summary.items():
+            base = stats[0]
+            print(k, "| A |", "%.1f"%base["median"], "| 1.000 | | |")
+            for i in range(1, len(stats)):
+                s = stats[i]
+                speedup = s["median"] / base["median"]
+                speedups[i].append(speedup)
+                lo, hi = ratio_ci(base["samples"], s["samples"], self.__measurement.confidence)
+                p = mann_whitney_p(base["samples"], s["samples"])
+                print(k, "|", chr(ord("A") + i), "|", "%.1f"%s["median"], "|", "%.3f"%speedup, "|",
+                      "%.3f-%.3f"%(lo, hi), "|", "%.4f"%p, "|")
+        for i in range(1, len(paths)):
+            print("geomean speedup %s vs A = %.3f" % (chr(ord("A") + i), geomean(speedups[i])))
+        pass
 
     def __print_summary(self):
-        for k,v in self.__summary.items():
-            check_coefficient_of_variation(k, v)
-            print(k, "|", "%.1f"%statistics.fmean(v), "|")
+        print("clip | median fps | mean | stddev | %d%% CI | runs |" % round(self.__measurement.confidence * 100))
+        for k,s in self.__summary.items():
+            check_coefficient_of_variation(k, s["samples"])
+            if not s["converged"]:
+                print("CI did not reach %.1f%% of the median in %d runs for %s" % (self.__measurement.ci_width * 100, s["runs"], k))
+            runs = str(s["runs"]) + (" (%d outliers)" % s["rejected"] if s["rejected"] else "")
+            print(k, "|", "%.1f"%s["median"], "|", "%.1f"%s["mean"], "|", "%.2f"%s["stdev"], "|",
+                  "%.1f-%.1f"%s["ci"], "|", runs, "|")
+        self.__print_counters()
+        self.__print_realtime()
         pass
 
+    def __print_realtime(self):
+        if not self.args.realtime:
+            return
+        print("clip | target fps | median fps | real-time factor | headroom | real time with %d%% margin |" % round(self.args.rt_margin * 100))
+        for k, s in self.__summary.items():
+            target = clip_frame_rate(self.__env.sources[k], self.args.ffmpeg_path)
+            if not target:
+                print(k, "| unknown frame rate |")
+                continue
+            factor, headroom, ok = realtime(s["median"], target, self.args.rt_margin)
+            print(k, "|", "%.2f"%target, "|", "%.1f"%s["median"], "|", "%.2fx"%factor, "|", "%+.0f%%"%(headroom * 100), "|",
+                  "yes" if ok else "NO", "|")
+
+    def __print_counters(self):
+        if not self.__counters:
+            return
+        print("clip | instructions | cycles | IPC | branch-misses | LLC-load-misses | instructions/frame | cycles/frame |")
+        for k, c in self.__counters.items():
+            def v(event, fmt="%.4g"):
+                return fmt % c[event] if event in c else "-"
+            print(k, "|", v("instructions"), "|", v("cycles"), "|", v("ipc", "%.2f"), "|", v("branch-misses"), "|",
+                  v("LLC-load-misses"), "|", v("instructions/frame"), "|", v("cycles/frame"), "|")
+
+    def __record_history(self):
+        history = BenchHistory(self.args.history)
+        fp = self.__host
+        regressions = 0
+        for k, s in self.__summary.items():
+            entry = dict(self.__app.config(), clip=k, decoder=self.__app.identity(), host=host_id(fp), host_fp=fp,
+                         median=s["median"], mean=s["mean"], stdev=s["stdev"], ci=list(s["ci"]), runs=s["runs"])
+            if k in self.__counters:
+                entry["counters"] = self.__counters[k]
+            if self.args.compare_to:
+                baseline = history.baseline(entry, self.args.compare_to, self.args.history_window)
+                dropped, base, threshold = BenchHistory.check(entry, baseline)
+                if base is None:
+                    print("no history to compare %s with" % k)
+                elif dropped:
+                    regressions += 1
+                    print("REGRESSION %s: %.1f fps, history median %.1f over %d runs, threshold %.1f" % (k, s["median"], base, len(baseline), threshold))
+                else:
+                    print("ok %s: %.1f fps, history median %.1f" % (k, s["median"], base))
+            if not self.args.no_history:
+                history.append(entry)
+        return regressions
+
 def check_coefficient_of_variation(k, v):
     mean = statistics.fmean(v)
-    if mean > 0:
+    if mean > 0 and len(v) > 1:
         cv = statistics.stdev(v) / mean
         if (cv > 0.1):
             print("cv is high for " + k + ", " + str(v))
@@ -20,58 +20,182 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import csv
+import json
 import statistics
 import subprocess
 from utils.runner import *
 from utils.perfapp import *
+from utils.cpus import logical_cpus, physical_cores, spread_cpus
+from utils.benchenv import BenchEnv
+from utils.measure import Measurement
+from utils.scaling import analyze
+from utils import proc
+from utils.framerate import clip_frame_rate, realtime
+from utils.cache import default_cache_dir
+from utils.history import TimingDB
+
+def default_thread_counts():
+    # powers of two, plus one thread per physical core and one per logical cpu (the SMT points)
+    logical = len(logical_cpus())
+    counts = {physical_cores(), logical}
+    n = 1
+    while n < logical:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
 
 class ThreadRunner(TestRunner):
     __summary = {}
     __app = None
     def run(self):
-        self.__app = self.__get_app()
+        self.__app = get_app(self.args)
+        self.__counts = default_thread_counts()
+        if self.args.thread_counts:
+            self.__counts = sorted(set(int(x) for x in self.args.thread_counts.split(",")))
+            if self.__counts[0] < 1:
+                raise Exception("--thread-counts must all be 1 or more, got %s" % self.args.thread_counts)
+        self.__measurement = Measurement.from_args(self.args)
+        self.__env = BenchEnv(self.args)
+        self.__host = self.__env.setup()
+        # ffmpeg.py's timing history and header cost model, for the timeouts
+        self.__timings = TimingDB(os.path.join(default_cache_dir(), "timings.json"))
 
-        files = self.list_files(self.args.test_path)
-        for f in files:
-            self.__test(f)
+        if self.args.stream:
+            files = self.stream_files(self.args.test_path, self.args.download_jobs, self.args.verify_jobs)
+        else:
+            files = self.list_files(self.args.test_path)
+        self.__env.each(files, self.__skip_timeout, self.__test)
 
         self.__print_summary()
+        self.__write_results()
 
     def add_args(self, parser):
         parser.add_argument("--vvdec-path", type=str)
+        parser.add_argument("--thread-counts", type=str, default=None,
+                            help="comma separated, defaults to powers of two plus the physical and logical cpu counts")
+        parser.add_argument("--pin", choices=["none", "spread", "compact"], default="none",
+                            help="pin n threads to n cpus, spread uses one cpu per physical core before SMT siblings")
+        parser.add_argument("--knee-gain", type=float, default=0.05, help="minimum fps gain for a thread step to count as scaling")
+        parser.add_argument("--realtime", action="store_true", help="find the fewest threads that decode faster than the clip's frame rate")
+        parser.add_argument("--rt-margin", type=float, default=0.2, help="required headroom over real time")
+        parser.add_argument("--csv", type=str, default=None)
+        parser.add_argument("--json", type=str, default=None)
+        Measurement.add_args(parser)
+        BenchEnv.add_args(parser)
+        parser.add_argument("--stream", action="store_true",
+                            help="start timing while the rest of the clips download, the downloads then compete with the decoder")
+
+    def __skip_timeout(self, test, *args):
+        # a hung or far too slow clip is left out, the points of the other clips are kept
+        try:
+            test(*args)
+        except subprocess.TimeoutExpired as e:
+            fn = os.path.basename(args[-1])
+            print("%s timed out after %.0f s, skipped" % (fn, e.timeout))
+            self.__summary.pop(fn, None)
+
+    def __timeout(self, input):
+        scale = self.args.timeout_scale * self.__app.timeout_scale(len(logical_cpus()))
+        return self.__timings.timeout(input, scale, self.args.min_timeout, 5 * 60)
 
-    def __get_app(self):
-        if self.args.vvdec_path:
-            return VVDecApp(self.args.vvdec_path)
-        return FFmpegApp(self.args.ffmpeg_path)
+    def __cpus_for(self, threads):
+        if self.args.pin == "none":
+            return None
+        cpus = spread_cpus() if self.args.pin == "spread" else logical_cpus()
+        return cpus[:threads]
 
     def __test(self, input):
         fn = os.path.basename(input)
-        self.__summary[fn] = [[], []]
+        self.__summary[fn] = [{}, {}]
         for i in [1, 0]:
-            fps = self.__summary[fn][i]
-            for j in [16, 8, 4, 2, 1]:
+            for j in reversed(self.__counts):
                 self.__app.set_asm(i)
                 self.__app.set_threads(j)
                 cmd = self.__app.get_cmd(input)
+                cpus = self.__cpus_for(j)
+                timeout = self.__timeout(input)
                 print(cmd)
-                try:
-                    o = subprocess.run(cmd.split(), capture_output=True, timeout=5 * 60)
+                def run_once():
+                    returncode, stdout, stderr, _ = proc.run(cmd.split(), timeout, cpus)
+                    o = subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
                     if o.returncode:
                         raise Exception(o.stderr)
                     o = self.__app.get_fps(o)
                     print("fps = ", o)
-                    fps.append(o)
+                    return o
+                try:
+                    self.__summary[fn][i][j] = self.__measurement.run(run_once)
                 except Exception as e:
                     print(e)
                     raise
 
+    def __analysis(self):
+        for k, v in self.__summary.items():
+            for i, msg in [(0, "no asm"), (1, "with asm")]:
+                fps = {n: s["median"] for n, s in v[i].items()}
+                yield k, msg, v[i], analyze(fps, self.args.knee_gain)
+
     def __print_summary(self):
         for k,v in self.__summary.items():
-            print_summary(k, "no asm", v[0])
-            print_summary(k, "with asm", v[1])
+            print_summary(k, "no asm", [v[0][n]["median"] for n in reversed(self.__counts)])
+            print_summary(k, "with asm", [v[1][n]["median"] for n in reversed(self.__counts)])
+        for k, msg, stats, a in self.__analysis():
+            print("%s, %s:" % (k, msg))
+            print("    threads | fps | CI | speedup | efficiency |")
+            for p in a["points"]:
+                print("    %d | %.1f | %.1f-%.1f | %.2f | %.2f |" % (p["threads"], p["fps"], *stats[p["threads"]]["ci"], p["speedup"], p["efficiency"]))
+            f = a["serial_fraction"]
+            print("    serial fraction = %s, knee at %d threads" % ("%.3f" % f if f is not None else "n/a", a["knee"]))
+            if self.args.realtime:
+                self.__print_realtime(k, a)
         pass
 
+    def __realtime(self, k, a):
+        # (target fps, fewest threads sustaining it with the margin or None, {threads: real-time factor})
+        target = clip_frame_rate(self.__env.sources[k], self.args.ffmpeg_path)
+        if not target:
+            return None, None, {}
+        factors = {}
+        min_threads = None
+        for p in a["points"]:
+            factor, _, ok = realtime(p["fps"], target, self.args.rt_margin)
+            factors[p["threads"]] = factor
+            if ok and min_threads is None:
+                min_threads = p["threads"]
+        return target, min_threads, factors
+
+    def __print_realtime(self, k, a):
+        target, min_threads, factors = self.__realtime(k, a)
+        if not target:
+            print("    unknown frame rate, no real-time analysis")
+            return
+        print("    target %.2f fps, real-time factor: %s" % (target, ", ".join("%d: %.2fx" % x for x in factors.items())))
+        if min_threads is None:
+            print("    NOT real time with %d%% margin at any measured thread count" % round(self.args.rt_margin * 100))
+        else:
+            print("    real time with %d%% margin from %d threads" % (round(self.args.rt_margin * 100), min_threads))
+
+    def __write_results(self):
+        rows = []
+        for k, msg, stats, a in self.__analysis():
+            target, min_threads, factors = self.__realtime(k, a) if self.args.realtime else (None, None, {})
+            for p in a["points"]:
+                lo, hi = stats[p["threads"]]["ci"]
+                rows.append(dict(p, clip=k, asm=(msg == "with asm"), ci_lo=lo, ci_hi=hi, runs=stats[p["threads"]]["runs"],
+                                 serial_fraction=a["serial_fraction"], knee=a["knee"], target_fps=target,
+                                 realtime_factor=factors.get(p["threads"]), min_realtime_threads=min_threads))
+        if self.args.csv:
+            with open(self.args.csv, "w", newline="") as f:
+                w = csv.DictWriter(f, fieldnames=["clip", "asm", "threads", "fps", "ci_lo", "ci_hi", "runs",
+                                                  "speedup", "efficiency", "serial_fraction", "knee",
+                                                  "target_fps", "realtime_factor", "min_realtime_threads"])
+                w.writeheader()
+                w.writerows(rows)
+        if self.args.json:
+            with open(self.args.json, "w") as f:
+                json.dump(rows, f, indent=1)
+
 def print_summary(fn, msg, a):
     s = fn + ", " + msg + " fps : {"
     for fps in a:
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# long-lived decoder processes for corpora of tiny clips, where starting ffmpeg costs more than the decode.
+# run as a script the worker loads libavformat/libavcodec/libavutil with ctypes and answers one json
+# request per line with what "ffmpeg -f vvc -i <clip> -vsync 0 -noautoscale -f md5 -" would print
+import ctypes
+import errno
+import hashlib
+import json
+import os
+import queue
+import subprocess
+import sys
+from utils import proc
+from utils.cache import linked_libs
+
+# the directory utils/ is in, the worker runs as "python -m utils.avworker" from there
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AVMEDIA_TYPE_VIDEO = 0
+AV_LOG_QUIET = -8
+AVERROR_EOF = -(ord("E") | ord("O") << 8 | ord("F") << 16 | ord(" ") << 24)
+AVERROR_EAGAIN = -errno.EAGAIN
+
+# leading members only, these have not moved in the releases that have a vvc decoder
+class AVFormatContext(ctypes.Structure):
+    _fields_ = [("av_class", ctypes.c_void_p), ("iformat", ctypes.c_void_p), ("oformat", ctypes.c_void_p),
+                ("priv_data", ctypes.c_void_p), ("pb", ctypes.c_void_p), ("ctx_flags", ctypes.c_int),
+                ("nb_streams", ctypes.c_uint), ("streams", ctypes.POINTER(ctypes.c_void_p))]
+
+class AVStream(ctypes.Structure):
+    _fields_ = [("av_class", ctypes.c_void_p), ("index", ctypes.c_int), ("id", ctypes.c_int),
+                ("codecpar", ctypes.c_void_p)]
+
+class AVPacket(ctypes.Structure):
+    _fields_ = [("buf", ctypes.c_void_p), ("pts", ctypes.c_int64), ("dts", ctypes.c_int64),
+                ("data", ctypes.c_void_p), ("size", ctypes.c_int), ("stream_index", ctypes.c_int)]
+
+class AVFrame(ctypes.Structure):
+    _fields_ = [("data", ctypes.c_void_p * 8), ("linesize", ctypes.c_int * 8), ("extended_data", ctypes.c_void_p),
+                ("width", ctypes.c_int), ("height", ctypes.c_int), ("nb_samples", ctypes.c_int), ("format", ctypes.c_int)]
+
+def find_libs(ffmpeg_path):
+    # the libav* an ffmpeg build is linked against, None for static builds
+    libs = {}
+    for lib in linked_libs(ffmpeg_path):
+        name = os.path.basename(lib).split(".")[0].split("-")[0]
+        libs.setdefault(name, lib)
+    if not all(n in libs for n in ("libavutil", "libavcodec", "libavformat")):
+        return None
+    return [libs["libavutil"], libs["libavcodec"], libs["libavformat"]]
+
+class LibAV:
+    def __init__(self, avutil, avcodec, avformat):
+        P, I = ctypes.c_void_p, ctypes.c_int
+        PP = ctypes.POINTER(ctypes.c_void_p)
+        self.avutil = ctypes.CDLL(avutil, mode=ctypes.RTLD_GLOBAL)
+        self.avcodec = ctypes.CDLL(avcodec, mode=ctypes.RTLD_GLOBAL)
+        self.avformat = ctypes.CDLL(avformat, mode=ctypes.RTLD_GLOBAL)
+        protos = [
+            (self.avutil, "av_log_set_level", None, [I]),
+            (self.avutil, "av_dict_set", I, [PP, ctypes.c_char_p, ctypes.c_char_p, I]),
+            (self.avutil, "av_dict_free", None, [PP]),
+            (self.avutil, "av_frame_alloc", P, []),
+            (self.avutil, "av_frame_free", None, [PP]),
+            (self.avutil, "av_frame_unref", None, [P]),
+            (self.avutil, "av_image_get_buffer_size", I, [I, I, I, I]),
+            (self.avutil, "av_image_copy_to_buffer", I, [P, I, P, P, I, I, I, I]),
+            (self.avformat, "av_find_input_format", P, [ctypes.c_char_p]),
+            (self.avformat, "avformat_open_input", I, [PP, ctypes.c_char_p, P, PP]),
+            (self.avformat, "avformat_find_stream_info", I, [P, P]),
+            (self.avformat, "av_find_best_stream", I, [P, I, I, I, PP, I]),
+            (self.avformat, "av_read_frame", I, [P, P]),
+            (self.avformat, "avformat_close_input", None, [PP]),
+            (self.avcodec, "avcodec_alloc_context3", P, [P]),
+            (self.avcodec, "avcodec_parameters_to_context", I, [P, P]),
+            (self.avcodec, "avcodec_open2", I, [P, P, PP]),
+            (self.avcodec, "avcodec_send_packet", I, [P, P]),
+            (self.avcodec, "avcodec_receive_frame", I, [P, P]),
+            (self.avcodec, "avcodec_free_context", None, [PP]),
+            (self.avcodec, "av_packet_alloc", P, []),
+            (self.avcodec, "av_packet_free", None, [PP]),
+            (self.avcodec, "av_packet_unref", None, [P]),
+        ]
+        for lib, name, restype, argtypes in protos:
+            fn = getattr(lib, name)
+            fn.restype = restype
+            fn.argtypes = argtypes
+            setattr(self, name, fn)
+        self.av_log_set_level(AV_LOG_QUIET)
+        self.vvc = self.av_find_input_format(b"vvc")
+
+    def __hash_frame(self, frame, md5):
+        # the rawvideo encoder behind -f md5 packs every frame with align 1
+        f = ctypes.cast(frame, ctypes.POINTER(AVFrame)).contents
+        size = self.av_image_get_buffer_size(f.format, f.width, f.height, 1)
+        if size < 0:
+            return size
+        buf = ctypes.create_string_buffer(size)
+        ret = self.av_image_copy_to_buffer(buf, size, ctypes.addressof(f.data), ctypes.addressof(f.linesize),
+                                           f.format, f.width, f.height, 1)
+        if ret < 0:
+            return ret
+        md5.update(buf.raw)
+        return 0
+
+    def __drain(self, dec, frame, md5):
+        errors = 0
+        while True:
+            ret = self.avcodec_receive_frame(dec, frame)
+            if ret in (AVERROR_EAGAIN, AVERROR_EOF):
+                return errors
+            if ret < 0:
+                # the decoder is in an error state, asking again would spin on the same error
+                return errors + 1
+            if self.__hash_frame(frame, md5) < 0:
+                errors += 1
+            self.av_frame_unref(frame)
+
+    def decode(self, path, threads=None):
+        # (returncode, stdout), returncode is 1 when anything failed, ffmpeg's own codes are not reproduced
+        md5 = hashlib.md5()
+        errors = 0
+        ic = ctypes.c_void_p()
+        dec = ctypes.c_void_p()
+        pkt = ctypes.c_void_p(self.av_packet_alloc())
+        frame = ctypes.c_void_p(self.av_frame_alloc())
+        opts = ctypes.c_void_p()
+        try:
+            if self.avformat_open_input(ctypes.byref(ic), path.encode(), self.vvc, None) < 0:
+                return 1, ""
+            if self.avformat_find_stream_info(ic, None) < 0:
+                return 1, ""
+            codec = ctypes.c_void_p()
+            index = self.av_find_best_stream(ic, AVMEDIA_TYPE_VIDEO, -1, -1, ctypes.byref(codec), 0)
+            if index < 0 or not codec:
+                return 1, ""
+            fmt = ctypes.cast(ic, ctypes.POINTER(AVFormatContext)).contents
+            st = ctypes.cast(fmt.streams[index], ctypes.POINTER(AVStream)).contents
+            dec = ctypes.c_void_p(self.avcodec_alloc_context3(codec))
+            if self.avcodec_parameters_to_context(dec, st.codecpar) < 0:
+                return 1, ""
+            # the same decoder options as "ffmpeg -strict -2 [-threads n]"
+            self.av_dict_set(ctypes.byref(opts), b"strict", b"-2", 0)
+            self.av_dict_set(ctypes.byref(opts), b"threads", str(threads or "auto").encode(), 0)
+            if self.avcodec_open2(dec, codec, ctypes.byref(opts)) < 0:
+                return 1, ""
+            while True:
+                ret = self.av_read_frame(ic, pkt)
+                if ret < 0:
+                    errors += ret != AVERROR_EOF
+                    break
+                if ctypes.cast(pkt, ctypes.POINTER(AVPacket)).contents.stream_index == index:
+                    if self.avcodec_send_packet(dec, pkt) < 0:
+                        errors += 1
+                    errors += self.__drain(dec, frame, md5)
+                self.av_packet_unref(pkt)
+            self.avcodec_send_packet(dec, None)
+            errors += self.__drain(dec, frame, md5)
+            return (1 if errors else 0), "MD5=" + md5.hexdigest() + "\n"
+        finally:
+            self.av_dict_free(ctypes.byref(opts))
+            self.avcodec_free_context(ctypes.byref(dec))
+            self.avformat_close_input(ctypes.byref(ic))
+            self.av_packet_free(ctypes.byref(pkt))
+            self.av_frame_free(ctypes.byref(frame))
+
+def serve(libs):
+    av = LibAV(*libs)
+    for line in sys.stdin:
+        req = json.loads(line)
+        returncode, stdout = av.decode(req["path"], req.get("threads"))
+        sys.stdout.write(json.dumps({"returncode": returncode, "stdout": stdout}) + "\n")
+        sys.stdout.flush()
+
+class Worker:
+    # one worker process, respawned after it dies. a crash is the current clip's
+    def __init__(self, libs):
+        self.__libs = libs
+        self.__process = None
+
+    def decode(self, path, threads, timeout, cpus=None):
+        # (returncode, stdout), a negative returncode is the signal that killed the worker on this clip,
+        # None when it exited by itself, e.g. on a python error
+        if self.__process is None:
+            self.__process = subprocess.Popen([sys.executable, "-m", "utils.avworker"] + self.__libs, cwd=TOOLS_DIR,
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                              text=True)
+        process = self.__process
+        # decoder threads are created per clip and inherit it
+        proc.pin(process, cpus)
+        watchdog = proc.Watchdog(process, timeout)
+        try:
+            try:
+                process.stdin.write(json.dumps({"path": os.path.abspath(path), "threads": threads}) + "\n")
+                process.stdin.flush()
+                line = process.stdout.readline()
+            except BrokenPipeError:
+                line = ""
+        finally:
+            watchdog.cancel()
+        if line:
+            r = json.loads(line)
+            return r["returncode"], r["stdout"]
+        self.__process = None
+        process.stdin.close()
+        process.stdout.close()
+        returncode = process.wait()
+        if watchdog.fired.is_set():
+            raise subprocess.TimeoutExpired(path, timeout)
+        return (returncode if returncode < 0 else None), ""
+
+    def close(self):
+        if self.__process:
+            self.__process.stdin.close()
+            self.__process.wait()
+            self.__process.stdout.close()
+            self.__process = None
+
+class WorkerPool:
+    # one worker per concurrent decode, handed out to the runner's threads
+    def __init__(self, libs, size):
+        self.__idle = queue.LifoQueue()
+        for _ in range(size):
+            self.__idle.put(Worker(libs))
+        self.__size = size
+
+    def decode(self, path, threads, timeout, cpus=None):
+        worker = self.__idle.get()
+        try:
+            return worker.decode(path, threads, timeout, cpus)
+        finally:
+            self.__idle.put(worker)
+
+    def close(self):
+        for _ in range(self.__size):
+            self.__idle.get().close()
+
+if __name__ == "__main__":
+    serve(sys.argv[1:])
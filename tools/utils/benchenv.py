@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+from utils.cpus import logical_cpus
+from utils.host import fingerprint
+
+def parse_cpu_list(s):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    cpus = set()
+    for part in s.split(","):
+        if "-" in part:
+            a, b = part.split("-")
+            cpus.update(range(int(a), int(b) + 1))
+        elif part:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+def read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def governors(cpus):
+    return {cpu: read("/sys/devices/system/cpu/cpu%d/cpufreq/scaling_governor" % cpu) for cpu in cpus}
+
+def turbo():
+    # True/False where the kernel tells, None otherwise
+    no_turbo = read("/sys/devices/system/cpu/intel_pstate/no_turbo")
+    if no_turbo is not None:
+        return no_turbo == "0"
+    boost = read("/sys/devices/system/cpu/cpufreq/boost")
+    if boost is not None:
+        return boost == "1"
+    return None
+
+class BenchEnv:
+    # cpu pinning, frequency/turbo/load checks and input staging around timed runs
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("--cpu-set", type=str, default=None, help="run every decode on these cpus, e.g. 2-7")
+        parser.add_argument("--stage", choices=["none", "cache", "tmpfs"], default="cache",
+                            help="read each input into the page cache, or copy it to tmpfs, before timing it")
+        parser.add_argument("--max-load", type=float, default=0.5, help="warn when the 1 minute load average is above this")
+
+    def __init__(self, args):
+        self.args = args
+        self.__tmp = None
+        # file name -> original path of every clip run through each(), the staged copies are gone by the report
+        self.sources = {}
+
+    def setup(self):
+        if self.args.cpu_set and hasattr(os, "sched_setaffinity"):
+            # children inherit the mask, including the per-thread-count pinning of threads.py
+            os.sched_setaffinity(0, parse_cpu_list(self.args.cpu_set))
+        fp = self.fingerprint()
+        print("host: " + ", ".join("%s=%s" % kv for kv in sorted(fp.items())))
+        for w in self.warnings(fp):
+            print("warning: " + w)
+        return fp
+
+    def fingerprint(self):
+        fp = fingerprint()
+        cpus = logical_cpus()
+        govs = set(g for g in governors(cpus).values() if g)
+        fp["cpu_set"] = self.args.cpu_set or "all"
+        fp["governor"] = ",".join(sorted(govs)) if govs else "unknown"
+        t = turbo()
+        fp["turbo"] = "unknown" if t is None else "on" if t else "off"
+        return fp
+
+    def warnings(self, fp):
+        w = []
+        if fp["governor"] not in ("performance", "unknown"):
+            w.append("cpufreq governor is %s, not performance, results will depend on frequency ramp-up" % fp["governor"])
+        if fp["turbo"] == "on":
+            w.append("turbo is on, clock speed will vary with temperature and load")
+        w += self.load_warnings()
+        return w
+
+    def load_warnings(self):
+        if not hasattr(os, "getloadavg"):
+            return []
+        load = os.getloadavg()[0]
+        if load > self.args.max_load:
+            return ["1 minute load average is %.2f, other processes are competing for the cpus" % load]
+        return []
+
+    def each(self, files, test, *args):
+        # every clip is staged (page cache or tmpfs) right before it is timed, test(*args, staged path)
+        try:
+            for f in files:
+                self.sources[os.path.basename(f)] = f
+                path = self.stage(f)
+                try:
+                    test(*args, path)
+                finally:
+                    self.unstage(path)
+        finally:
+            self.cleanup()
+
+    def stage(self, f):
+        # returns the path to time, call before every clip
+        for w in self.load_warnings():
+            print("warning: " + w)
+        if self.args.stage == "cache":
+            with open(f, "rb") as src:
+                while src.read(1 << 20):
+                    pass
+            return f
+        if self.args.stage == "tmpfs":
+            if not self.__tmp:
+                base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+                self.__tmp = tempfile.mkdtemp(prefix="ffvvc-", dir=base)
+            dst = os.path.join(self.__tmp, os.path.basename(f))
+            shutil.copyfile(f, dst)
+            return dst
+        return f
+
+    def unstage(self, path):
+        if self.__tmp and os.path.dirname(path) == self.__tmp:
+            os.remove(path)
+
+    def cleanup(self):
+        if self.__tmp:
+            shutil.rmtree(self.__tmp, ignore_errors=True)
+            self.__tmp = None
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import subprocess
+import threading
+import time
+
+def default_cache_dir():
+    if os.getenv("FFVVC_CACHE_DIR"):
+        return os.getenv("FFVVC_CACHE_DIR")
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ffvvc-tests")
+
+def linked_libs(path):
+    # only libav*/libsw* matter, a rebuilt libavcodec.so changes results without touching ffmpeg itself
+    try:
+        o = subprocess.run(["ldd", path], capture_output=True, timeout=30)
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return []
+    libs = re.findall(r"=>\s*(\S*/lib(?:av|sw|postproc)\S*\.so\S*)", o.stdout.decode(errors="ignore"))
+    return sorted(set(libs))
+
+def hash_file(md5, path):
+    # one update over a mapping, hashlib drops the GIL for it so several files hash in parallel
+    with open(path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                md5.update(m)
+                return
+        except (ValueError, OSError):
+            # empty files and files that cannot be mapped
+            pass
+        for chunk in iter(lambda: f.read(8 << 20), b""):
+            md5.update(chunk)
+
+def stat_key(st):
+    # changes whenever the file is replaced or rewritten
+    return "%d:%d:%d:%d" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def write_json(path, data, **kwargs):
+    # through a tmp file and a rename, readers see the old or the new file and never a partial one
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".%d.tmp" % os.getpid()
+    with open(tmp, "w") as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp, path)
+
+def merge_by_stat(saved, entries):
+    # entries keyed by stat_key with a "path", over what other runs saved meanwhile,
+    # minus the files that were deleted or changed since they were read
+    merged = dict(saved)
+    merged.update(entries)
+    for key, e in list(merged.items()):
+        try:
+            valid = stat_key(os.stat(e["path"])) == key
+        except OSError:
+            valid = False
+        if not valid:
+            del merged[key]
+    return merged
+
+def binary_id(path):
+    md5 = hashlib.md5()
+    for p in [path] + linked_libs(path):
+        md5.update(os.path.basename(p).encode())
+        hash_file(md5, p)
+    return md5.hexdigest()
+
+class ResultCache:
+    # persistent map of (decoder, bitstream, command line) -> raw decoder outcome
+    VERSION = 1
+
+    def __init__(self, dir, max_entries=20000):
+        self.__path = os.path.join(dir, "results.json")
+        self.__max_entries = max_entries
+        self.__lock = threading.Lock()
+        self.__entries = self.__load()
+        self.__dirty = False
+
+    def __load(self):
+        try:
+            with open(self.__path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                return data["entries"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return {}
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key):
+        with self.__lock:
+            e = self.__entries.get(key)
+            if e is None:
+                return None
+            e["used"] = time.time()
+            self.__dirty = True
+            return e["value"]
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__entries[key] = {"used": time.time(), "value": value}
+            self.__dirty = True
+
+    def __evict(self):
+        if len(self.__entries) <= self.__max_entries:
+            return
+        lru = sorted(self.__entries.items(), key=lambda kv: kv[1]["used"])
+        for k, _ in lru[: len(self.__entries) - self.__max_entries]:
+            del self.__entries[k]
+
+    def save(self):
+        with self.__lock:
+            if not self.__dirty:
+                return
+            # other runs may have saved meanwhile, keep their results and the latest use of each
+            entries = self.__load()
+            for k, e in self.__entries.items():
+                if k not in entries or entries[k]["used"] < e["used"]:
+                    entries[k] = e
+            self.__entries = entries
+            self.__evict()
+            write_json(self.__path, {"version": self.VERSION, "entries": self.__entries})
+            self.__dirty = False
+
+class Md5Cache:
+    # persistent md5 per (device, inode, size, mtime), so unchanged sources are not rehashed on every run
+    # rehash ignores what earlier runs remembered, e.g. after a file was changed in place with its mtime kept
+    def __init__(self, dir, rehash=False):
+        self.__path = os.path.join(dir, "md5.json")
+        self.__lock = threading.Lock()
+        self.__rehash = rehash
+        self.__entries = {} if rehash else self.__load()
+        self.__dirty = False
+
+    def __load(self):
+        try:
+            with open(self.__path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def md5(self, path):
+        key = stat_key(os.stat(path))
+        with self.__lock:
+            e = self.__entries.get(key)
+        if e is not None:
+            return e["md5"]
+        md5 = hashlib.md5()
+        hash_file(md5, path)
+        self.put(path, md5.hexdigest())
+        return md5.hexdigest()
+
+    def put(self, path, md5):
+        # for md5s known some other way, e.g. checked while downloading
+        key = stat_key(os.stat(path))
+        with self.__lock:
+            self.__entries[key] = {"md5": md5, "path": os.path.abspath(path)}
+            self.__dirty = True
+
+    def save(self):
+        with self.__lock:
+            if not self.__dirty:
+                return
+            entries = merge_by_stat(self.__load(), self.__entries)
+            write_json(self.__path, entries)
+            if not self.__rehash:
+                self.__entries = entries
+            self.__dirty = False
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# decode cost from stream headers alone, before a clip has ever been decoded
+
+CHROMA_FACTOR = {400: 1.0, 420: 1.5, 422: 2.0, 444: 3.0}
+# for streams without a readable sps, about the work per byte of the 1080p conformance clips
+WORK_PER_BYTE = 300.0
+# the decoder process before it allocates any picture
+BASE_MEMORY = 32 << 20
+
+def largest_size(info):
+    sizes = info.get("sizes") if info else None
+    return tuple(max(sizes, key=lambda s: s[0] * s[1])) if sizes else None
+
+def predict(info, size):
+    # (work, memory): work in luma-sample equivalents decoded, memory in bytes, None when unknown
+    res = largest_size(info)
+    if not res or not info.get("frames") or not info.get("chroma"):
+        return size * WORK_PER_BYTE, None
+    samples = res[0] * res[1] * CHROMA_FACTOR[max(info["chroma"])]
+    bytes_per_sample = 2 if max(info.get("bit_depth") or [8]) > 8 else 1
+    # the dpb plus the picture being decoded and the one being output
+    memory = BASE_MEMORY + (info.get("dpb", 0) + 2) * samples * bytes_per_sample
+    return info["frames"] * samples, memory
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import math
+import os
+import threading
+from utils.history import name_resolution
+
+def logical_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def core_of(cpu):
+    # (package, core) of a logical cpu, the cpu itself where the topology is not exposed
+    base = "/sys/devices/system/cpu/cpu%d/topology/" % cpu
+    try:
+        with open(base + "physical_package_id") as p, open(base + "core_id") as c:
+            return int(p.read()), int(c.read())
+    except (OSError, ValueError):
+        return 0, cpu
+
+def physical_cores():
+    return len(set(core_of(cpu) for cpu in logical_cpus()))
+
+def spread_cpus():
+    # one logical cpu per physical core first, then the SMT siblings
+    seen = {}
+    order = []
+    for cpu in logical_cpus():
+        core = core_of(cpu)
+        order.append((seen.get(core, 0), cpu))
+        seen[core] = seen.get(core, 0) + 1
+    return [cpu for _, cpu in sorted(order)]
+
+class CpuBudget:
+    # hands out disjoint core sets so concurrent decoders never add up to more than the machine has
+    def __init__(self, cpus=None):
+        self.__free = logical_cpus()
+        if cpus:
+            self.__free = self.__free[:cpus]
+        self.total = len(self.__free)
+        self.__cond = threading.Condition()
+
+    def cores_for(self, f, res=None):
+        # res from the stream headers where known, the name otherwise
+        res = res or name_resolution(f)
+        if res:
+            # about two cores per 1080p worth of pixels
+            cores = math.ceil(2 * res[0] * res[1] / (1920 * 1080))
+        else:
+            size = os.stat(f).st_size
+            cores = 1 if size < (256 << 10) else 2 if size < (4 << 20) else 4
+        return max(1, min(cores, self.total))
+
+    def acquire(self, n):
+        n = max(1, min(n, self.total))
+        with self.__cond:
+            self.__cond.wait_for(lambda: len(self.__free) >= n)
+            cpus, self.__free = self.__free[:n], self.__free[n:]
+            return cpus
+
+    def release(self, cpus):
+        with self.__cond:
+            self.__free = sorted(self.__free + cpus)
+            self.__cond.notify_all()
+
+class MemoryBudget:
+    # admits decodes while their expected peak memory adds up to at most limit bytes
+    def __init__(self, limit):
+        self.limit = limit
+        self.__used = 0
+        self.__cond = threading.Condition()
+
+    def acquire(self, n):
+        # unknown costs nothing, a clip above the limit on its own still runs, alone
+        n = min(int(n or 0), self.limit)
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__used + n <= self.limit)
+            self.__used += n
+            return n
+
+    def release(self, n):
+        with self.__cond:
+            self.__used -= n
+            self.__cond.notify_all()
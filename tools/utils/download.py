@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import http.client
+import os
+import time
+import urllib.error
+import urllib.request
+import tqdm
+
+CHUNK_SIZE = 1 << 20
+
+class DownloadError(Exception):
+    pass
+
+def part_path(dest):
+    return dest + ".part"
+
+def fetch(url, dest, md5=None, retries=5, backoff=2.0, desc=None):
+    # downloads url to dest through dest.part, resuming with a Range request after interruptions,
+    # and checks md5 on the bytes as they arrive. dest only appears once it is complete and verified
+    part = part_path(dest)
+    for attempt in range(retries + 1):
+        try:
+            got = _fetch_once(url, part, desc or dest)
+            break
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            if isinstance(e, urllib.error.HTTPError) and 400 <= e.code < 500 and e.code not in (408, 429):
+                raise
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print("%s: %s, retrying in %.1fs" % (url, e, delay))
+            time.sleep(delay)
+
+    if md5 and got != md5:
+        os.remove(part)
+        raise DownloadError("Source MD5 mismatch for %s: expected %s, got %s" % (dest, md5, got))
+    os.replace(part, dest)
+    return dest
+
+def _resume_state(part):
+    # md5 of what is already on disk, read once per resume, not on the happy path
+    md5 = hashlib.md5()
+    size = 0
+    if os.path.exists(part):
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                md5.update(chunk)
+                size += len(chunk)
+    return md5, size
+
+def _fetch_once(url, part, desc):
+    md5, size = _resume_state(part)
+    req = urllib.request.Request(url)
+    if size:
+        req.add_header("Range", "bytes=%d-" % size)
+    try:
+        resp = urllib.request.urlopen(req, timeout=60)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and size:
+            # nothing left to fetch, the part file is already complete
+            return md5.hexdigest()
+        raise
+    with resp:
+        if size and resp.status != 206:
+            # the server ignored the Range header, start over
+            md5, size = hashlib.md5(), 0
+        length = resp.headers.get("Content-Length")
+        total = size + int(length) if length else None
+        with open(part, "ab" if size else "wb") as f, \
+             tqdm.tqdm(desc="Downloading " + desc, total=total, initial=size, unit="B", unit_scale=True,
+                       miniters=1, dynamic_ncols=True) as pbar:
+            for chunk in iter(lambda: resp.read(CHUNK_SIZE), b""):
+                f.write(chunk)
+                md5.update(chunk)
+                pbar.update(len(chunk))
+        if total is not None and os.path.getsize(part) < total:
+            raise OSError("connection closed after %d of %d bytes" % (os.path.getsize(part), total))
+    return md5.hexdigest()
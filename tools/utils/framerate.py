@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import re
+import subprocess
+
+def name_frame_rate(f):
+    # "..._50fps_...", "..._720p5994_..." or "<w>x<h>_<fps>_..." as in the performance clips
+    name = os.path.splitext(os.path.basename(f))[0]
+    m = re.search(r"(\d+(?:\.\d+)?)fps", name, re.IGNORECASE)
+    if m:
+        return float(m.group(1))
+    m = re.search(r"\d+p(\d{2})(\d{2})?(?:_|$)", name)
+    if m:
+        return float(m.group(1) + ("." + m.group(2) if m.group(2) else ""))
+    m = re.search(r"\d{3,5}x\d{3,5}_(\d+(?:\.\d+)?)(?:_|$)", name)
+    if m:
+        return float(m.group(1))
+    return None
+
+def probe_frame_rate(f, ffmpeg_path):
+    # raw VVC streams without VUI timing are reported as 25 fps by the demuxer, so this is only the fallback
+    try:
+        o = subprocess.run([ffmpeg_path, "-hide_banner", "-i", f], capture_output=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    m = re.search(r"Video:.*?(\d+(?:\.\d+)?) fps", o.stderr.decode(errors="ignore"))
+    return float(m.group(1)) if m else None
+
+def clip_frame_rate(f, ffmpeg_path=None):
+    fps = name_frame_rate(f)
+    if fps is None and ffmpeg_path:
+        fps = probe_frame_rate(f, ffmpeg_path)
+    return fps
+
+def realtime(fps, target, margin):
+    # (real-time factor, headroom, sustains target with margin)
+    factor = fps / target
+    return factor, factor - 1, fps >= target * (1 + margin)
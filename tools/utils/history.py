@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from utils.cache import write_json
+from utils.costmodel import largest_size, predict
+from utils.host import host_id
+from utils.toolindex import get_index
+
+def clip_key(f):
+    # path independent, so worktrees and CI checkouts share their history
+    return "%s:%d" % (os.path.basename(f), os.stat(f).st_size)
+
+def name_resolution(f):
+    m = re.search(r"(\d{3,5})x(\d{3,5})", os.path.basename(f))
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+class TimingDB:
+    # smoothed wall time and peak memory per clip, plus a header cost model fitted to them for clips
+    # without history. used to start the slowest clips first, and to size each clip's timeout
+    ALPHA = 0.5
+    DEFAULT_RATE = 3e-9  # seconds per unit of work, until there is history to fit it
+    VERSION = 2
+
+    def __init__(self, path):
+        self.__path = path
+        self.__index = get_index(os.path.dirname(path))
+        self.__lock = threading.Lock()
+        # clips recorded by this run, the rest of the file is left to other runs
+        self.__changed = set()
+        self.__walls, self.__rss, self.__model = self.__load()
+        self.__rate = self.__fit(self.__walls, 0) or self.DEFAULT_RATE
+        self.__mem_ratio = self.__fit(self.__rss, 1) or 1.0
+
+    def __load(self):
+        # (walls, rss, model)
+        try:
+            with open(self.__path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = {}
+        if data.get("version") == self.VERSION:
+            return data["walls"], data["rss"], data["model"]
+        # version 1 was {clip_key: wall}, without the model inputs to fit
+        return {k: v for k, v in data.items() if isinstance(v, (int, float))}, {}, {}
+
+    def __fit(self, measured, i):
+        # median of measured / predicted over the clips with both
+        ratios = [v / self.__model[k][i] for k, v in measured.items() if k in self.__model and self.__model[k][i]]
+        return statistics.median(ratios) if ratios else None
+
+    def info(self, f):
+        # clip_info() of f, None where the headers cannot be read
+        try:
+            return self.__index.info(f)
+        except (OSError, ValueError, EOFError, KeyError):
+            return None
+
+    def model(self, f):
+        return predict(self.info(f), os.stat(f).st_size)
+
+    def resolution(self, f):
+        return largest_size(self.info(f)) or name_resolution(f)
+
+    def get(self, f):
+        with self.__lock:
+            return self.__walls.get(clip_key(f))
+
+    def estimate(self, f):
+        wall = self.get(f)
+        if wall is not None:
+            return wall
+        return self.static_cost(f) * self.__rate
+
+    def memory(self, f):
+        # expected peak rss in bytes, None when neither history nor headers tell
+        with self.__lock:
+            rss = self.__rss.get(clip_key(f))
+        if rss is not None:
+            return rss
+        memory = self.model(f)[1]
+        return memory * self.__mem_ratio if memory else None
+
+    def timeout(self, f, scale, floor, cap):
+        # a multiple of the expected wall time, so a hung short clip does not hold a worker for the cap
+        return min(cap, max(floor, scale * self.estimate(f)))
+
+    def static_cost(self, f):
+        # relative cost from the file alone, the same on every host
+        return self.model(f)[0]
+
+    def record(self, f, wall, rss=None, fit=True):
+        # fit=False for walls that say nothing about the decode speed, e.g. timeouts
+        key = clip_key(f)
+        model = list(self.model(f))
+        with self.__lock:
+            old = self.__walls.get(key)
+            self.__walls[key] = wall if old is None else self.ALPHA * wall + (1 - self.ALPHA) * old
+            if rss:
+                old = self.__rss.get(key)
+                self.__rss[key] = rss if old is None else self.ALPHA * rss + (1 - self.ALPHA) * old
+            if fit:
+                self.__model[key] = model
+            else:
+                self.__model.pop(key, None)
+            self.__changed.add(key)
+
+    def save(self):
+        with self.__lock:
+            if not self.__changed:
+                return
+            # other runs may have saved meanwhile, only the clips recorded here replace theirs
+            walls, rss, model = self.__load()
+            for key in self.__changed:
+                walls[key] = self.__walls[key]
+                if key in self.__rss:
+                    rss[key] = self.__rss[key]
+                if key in self.__model:
+                    model[key] = self.__model[key]
+                else:
+                    model.pop(key, None)
+            write_json(self.__path, {"version": self.VERSION, "walls": walls, "rss": rss, "model": model},
+                       indent=0, sort_keys=True)
+            self.__walls, self.__rss, self.__model = walls, rss, model
+            self.__changed = set()
+        self.__index.save()
+
+class BenchHistory:
+    # append-only log of perf.py results, one JSON object per line
+    def __init__(self, path):
+        self.__path = path
+
+    def entries(self):
+        try:
+            with open(self.__path, "r") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def append(self, entry):
+        entry = dict(entry, time=time.time())
+        os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+        # a single short write in append mode, so concurrent runs do not interleave lines
+        with open(self.__path, "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    @staticmethod
+    def host(e):
+        # from the stored fingerprint where there is one, so older entries follow the current IDENTITY
+        return host_id(e["host_fp"]) if "host_fp" in e else e["host"]
+
+    @staticmethod
+    def same_point(a, b):
+        return all(a[k] == b[k] for k in ("clip", "threads", "asm")) and BenchHistory.host(a) == BenchHistory.host(b)
+
+    def baseline(self, entry, ref="recent", window=10):
+        # the last window results at the same clip/threads/asm/host, optionally only from one decoder
+        def matches(e):
+            if not self.same_point(e, entry):
+                return False
+            if ref == "recent":
+                return True
+            d = e["decoder"]
+            return d["hash"].startswith(ref) or ref in d["version"]
+        return [e for e in self.entries() if matches(e)][-window:]
+
+    @staticmethod
+    def check(entry, baseline, k=3.0, floor=0.01):
+        # (dropped, baseline median, threshold): noise is the spread of the history, this run's CI, or 1%
+        if not baseline:
+            return False, None, None
+        medians = [e["median"] for e in baseline]
+        base = statistics.median(medians)
+        mad = statistics.median(abs(m - base) for m in medians) * 1.4826
+        lo, hi = entry["ci"]
+        noise = max(mad, (hi - lo) / 2, floor * base)
+        threshold = base - k * noise
+        return entry["median"] < threshold, base, threshold
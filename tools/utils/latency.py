@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import math
+import subprocess
+import time
+from utils import proc
+
+def percentile(values, p):
+    # nearest-rank percentile
+    x = sorted(values)
+    return x[max(0, math.ceil(p / 100 * len(x)) - 1)]
+
+def frame_times(cmd, timeout):
+    # arrival time of every per-frame output line, relative to process start
+    start = time.monotonic()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    watchdog = proc.Watchdog(process, timeout)
+    times = []
+    try:
+        for line in process.stdout:
+            if not line.startswith(b"#"):
+                times.append(time.monotonic() - start)
+        process.wait()
+    finally:
+        watchdog.cancel()
+        process.stdout.close()
+    if watchdog.fired.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    if process.returncode:
+        raise Exception("%s exited with %d" % (cmd[0], process.returncode))
+    return times
+
+def summarize(runs):
+    # runs: [frame_times], intervals between consecutive frames pooled over all runs
+    ttff = [t[0] for t in runs if t]
+    gaps = [b - a for t in runs for a, b in zip(t, t[1:])]
+    s = {"runs": len(runs), "frames": len(runs[0]) if runs else 0}
+    if ttff:
+        s["ttff"] = sorted(ttff)[len(ttff) // 2]
+    if gaps:
+        for p in (50, 95, 99):
+            s["p%d" % p] = percentile(gaps, p)
+        s["max"] = max(gaps)
+    return s
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import math
+import random
+import statistics
+
+def median_ci(samples, confidence=0.95):
+    # distribution-free CI of the median from order statistics, the full range when n is too small
+    x = sorted(samples)
+    n = len(x)
+    if n < 2:
+        return x[0], x[-1]
+    best = (0, n - 1)
+    for j in range(0, n // 2):
+        k = n - 1 - j
+        # P(x[j] <= median <= x[k]) = P(j < B <= k) for B ~ Binomial(n, 1/2), counted from the lower side
+        p = sum(math.comb(n, i) for i in range(j + 1, k + 1)) / 2 ** n
+        if p < confidence:
+            break
+        best = (j, k)
+    return x[best[0]], x[best[1]]
+
+def reject_outliers(samples, k=3.0):
+    # drops samples more than k scaled MADs from the median, keeps everything if MAD is 0
+    med = statistics.median(samples)
+    mad = statistics.median(abs(x - med) for x in samples) * 1.4826
+    if mad == 0:
+        return list(samples), []
+    kept = [x for x in samples if abs(x - med) <= k * mad]
+    rejected = [x for x in samples if abs(x - med) > k * mad]
+    return kept, rejected
+
+def summarize(samples, confidence=0.95):
+    kept, rejected = reject_outliers(samples)
+    lo, hi = median_ci(kept, confidence)
+    return {
+        "median": statistics.median(kept),
+        "mean": statistics.fmean(kept),
+        "stdev": statistics.stdev(kept) if len(kept) > 1 else 0.0,
+        "ci": (lo, hi),
+        "runs": len(samples),
+        "rejected": len(rejected),
+        "samples": kept,
+    }
+
+class Measurement:
+    # repeats run() until the median CI is narrow enough relative to the median, or max_runs
+    def __init__(self, warmup=1, min_runs=5, max_runs=20, ci_width=0.02, confidence=0.95):
+        self.warmup = warmup
+        self.min_runs = max(2, min_runs)
+        self.max_runs = max(self.min_runs, max_runs)
+        self.ci_width = ci_width
+        self.confidence = confidence
+
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("--warmup", type=int, default=1, help="untimed runs before measuring")
+        parser.add_argument("--min-runs", type=int, default=5)
+        parser.add_argument("--max-runs", type=int, default=20)
+        parser.add_argument("--ci-width", type=float, default=0.02, help="stop once the median CI is within this fraction of the median")
+        parser.add_argument("--confidence", type=float, default=0.95)
+
+    @staticmethod
+    def from_args(args):
+        return Measurement(args.warmup, args.min_runs, args.max_runs, args.ci_width, args.confidence)
+
+    def converged(self, s):
+        lo, hi = s["ci"]
+        return s["median"] > 0 and (hi - lo) / s["median"] <= self.ci_width
+
+    def run(self, run_once):
+        for i in range(self.warmup):
+            run_once()
+        samples = []
+        while True:
+            samples.append(run_once())
+            if len(samples) < self.min_runs:
+                continue
+            s = summarize(samples, self.confidence)
+            if self.converged(s) or len(samples) >= self.max_runs:
+                s["converged"] = self.converged(s)
+                return s
+
+def mann_whitney_p(a, b):
+    # two-sided Mann-Whitney U p-value, normal approximation with tie correction
+    n1, n2 = len(a), len(b)
+    values = sorted([(x, 0) for x in a] + [(x, 1) for x in b])
+    ranks = [0.0] * len(values)
+    ties = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    r1 = sum(r for r, (_, g) in zip(ranks, values) if g == 0)
+    u = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))) if n > 1 else 0
+    if sigma == 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return math.erfc(max(z, 0) / math.sqrt(2))
+
+def ratio_ci(a, b, confidence=0.95, resamples=2000, seed=0):
+    # bootstrap CI of median(b) / median(a), seeded so reports are reproducible
+    rng = random.Random(seed)
+    ratios = []
+    for i in range(resamples):
+        ma = statistics.median(rng.choices(a, k=len(a)))
+        mb = statistics.median(rng.choices(b, k=len(b)))
+        ratios.append(mb / ma)
+    ratios.sort()
+    lo = ratios[int((1 - confidence) / 2 * resamples)]
+    hi = ratios[min(resamples - 1, int((1 + confidence) / 2 * resamples))]
+    return lo, hi
+
+def geomean(values):
+    return math.exp(statistics.fmean(math.log(v) for v in values))
@@ -20,41 +20,145 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import re
+import subprocess
+from utils.cache import binary_id
+
+# decoder kind -> PerfApp subclass, see backend() and create_app()
+BACKENDS = {}
+
+def backend(kind):
+    def register(cls):
+        BACKENDS[kind] = cls
+        return cls
+    return register
+
+def create_app(spec):
+    # "[label=]kind:path[@extra args]", e.g. "noavx2=ffmpeg:/usr/bin/ffmpeg@-cpuflags -avx2"
+    label = None
+    if "=" in spec.split(":", 1)[0]:
+        label, spec = spec.split("=", 1)
+    kind, rest = spec.split(":", 1)
+    if kind not in BACKENDS:
+        raise Exception("unknown decoder backend %s, known: %s" % (kind, ", ".join(sorted(BACKENDS))))
+    path, _, extra = rest.partition("@")
+    app = BACKENDS[kind](path)
+    app.set_extra(extra)
+    app.label = label or (kind + (" " + extra if extra else ""))
+    return app
+
+def get_app(args):
+    # the single decoder picked by --vvdec-path / --ffmpeg-path
+    if args.vvdec_path:
+        return VVDecApp(args.vvdec_path)
+    return FFmpegApp(args.ffmpeg_path)
+
 class PerfApp:
+    # how much slower than ffmpeg this decoder is at the same thread count
+    slowdown = 1
     def __init__(self, path):
         self._asm  = True
         self._threads = 0
+        self._extra = ""
+        self._identity = None
     def set_asm(self, enabled):
         self._asm = enabled
     def set_threads(self, threads):
         self._threads = threads
+    def set_extra(self, extra):
+        self._extra = extra
+    def decode_threads(self):
+        return self._threads
+    def timeout_scale(self, cpus):
+        # TimingDB estimates are for ffmpeg with asm on every cpu, fewer threads and plain C take longer
+        threads = self.decode_threads() or cpus
+        return self.slowdown * max(1, cpus / threads) * (1 if self._asm else 10)
+    def config(self):
+        c = {"threads": self._threads, "asm": bool(self._asm)}
+        if self._extra:
+            c["extra"] = self._extra
+        return c
+    def identity(self):
+        # version line plus a hash of the binary and its libav* libraries, computed once
+        if not self._identity:
+            path = self.get_path()
+            try:
+                o = subprocess.run([path] + self.version_args(), capture_output=True, timeout=30)
+                version = (o.stdout or o.stderr).decode(errors="ignore").strip().splitlines()[0]
+            except (OSError, subprocess.TimeoutExpired, IndexError):
+                version = ""
+            self._identity = {"version": version, "hash": binary_id(path)}
+        return self._identity
 
+@backend("ffmpeg")
 class FFmpegApp(PerfApp):
     def __init__(self, path):
         super().__init__(self)
         self.__path = path
         pass
+    def get_path(self):
+        return self.__path
+    def version_args(self):
+        return ["-version"]
     def get_cmd(self, input):
         extra = " " if self._asm else " -cpuflags 0"
         extra += " -threads " + str(self._threads) if self._threads else ""
+        extra += " " + self._extra
         cmd = self.__path + " -strict -2 " + extra + " -i " + input + " -vsync 0 -y -f null - "
         return cmd
+    def get_latency_cmd(self, input):
+        # one line on stdout per decoded frame, as soon as it is decoded
+        # framecrc is the cheapest per-frame muxer, flush_packets gets every line out immediately
+        return self.get_cmd(input).replace(" -f null - ", " -f framecrc -flush_packets 1 - ")
+    def get_frames(self, o):
+        frames = re.findall(r'frame=\s*(\d+)', o.stderr.decode())
+        return int(frames[-1]) if frames else None
     def get_fps(self, o):
         o = re.findall(r'fps=.*?q',o.stderr.decode())[-1]
         o = float(o.replace("fps=", "").replace("q", "").strip())
         return o
 
+@backend("vvdec")
 class VVDecApp(PerfApp):
     def __init__(self, path):
         super().__init__(self)
         self.__path = path
         pass
+    def get_path(self):
+        return self.__path
+    def version_args(self):
+        return ["--version"]
     def get_cmd(self, input):
         extra = " " if self._asm else " --simd 0"
         extra += " -t " + str(self._threads) if self._threads else ""
+        extra += " " + self._extra
         cmd = self.__path + extra + " -b " + input
         return cmd
+    def get_frames(self, o):
+        frames = re.findall(r'(\d+)\s+[Ff]rames', o.stdout.decode())
+        return int(frames[0]) if frames else None
     def get_fps(self, o):
         o = re.findall(r'@ .*?fps',o.stdout.decode())[0]
         o = float(o.replace("fps", "").replace("@", "").strip())
         return o
+
+@backend("vtm")
+class VTMDecApp(PerfApp):
+    # the reference DecoderApp, single threaded and without a SIMD switch
+    slowdown = 8
+    def __init__(self, path):
+        super().__init__(self)
+        self.__path = path
+        pass
+    def get_path(self):
+        return self.__path
+    def version_args(self):
+        return ["--version"]
+    def decode_threads(self):
+        return 1
+    def get_cmd(self, input):
+        return self.__path + " " + self._extra + " -b " + input
+    def get_frames(self, o):
+        return len(re.findall(r'^POC\s+\d+', o.stdout.decode(), re.MULTILINE))
+    def get_fps(self, o):
+        t = float(re.findall(r'Total Time:\s*([\d.]+)', o.stdout.decode())[-1])
+        return self.get_frames(o) / t
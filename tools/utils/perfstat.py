@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import statistics
+import tempfile
+
+EVENTS = ["instructions", "cycles", "branch-misses", "LLC-load-misses"]
+
+def available():
+    return shutil.which("perf") is not None
+
+class PerfStat:
+    # wraps a decoder command line in `perf stat` and collects its counters
+    def __init__(self, events=EVENTS):
+        self.events = events
+
+    def wrap(self, cmd, out):
+        return ["perf", "stat", "-x", ",", "-e", ",".join(self.events), "-o", out, "--"] + cmd
+
+    @staticmethod
+    def parse(text):
+        # perf stat -x, lines: value,unit,event,run time,percentage,...
+        counters = {}
+        for line in text.splitlines():
+            fields = line.split(",")
+            if line.startswith("#") or len(fields) < 3:
+                continue
+            try:
+                value = float(fields[0])
+            except ValueError:
+                # <not counted> / <not supported>
+                continue
+            event = fields[2].split(":")[0]
+            counters[event] = value
+        return counters
+
+    def run(self, run_cmd, cmd):
+        # run_cmd(argv) runs the wrapped command, returns (its result, counters)
+        fd, out = tempfile.mkstemp(suffix=".perfstat")
+        os.close(fd)
+        try:
+            result = run_cmd(self.wrap(cmd, out))
+            with open(out, "r") as f:
+                return result, self.parse(f.read())
+        finally:
+            os.remove(out)
+
+def summarize(samples, frames=None):
+    # medians over runs of each counter, plus IPC and per-frame figures
+    s = {}
+    for event in set(k for c in samples for k in c):
+        values = [c[event] for c in samples if event in c]
+        s[event] = statistics.median(values)
+    if s.get("cycles"):
+        s["ipc"] = s.get("instructions", 0) / s["cycles"]
+    if frames:
+        for event in list(s):
+            if event != "ipc":
+                s[event + "/frame"] = s[event] / frames
+    return s
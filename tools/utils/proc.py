@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+def kill(process, group=False):
+    # group kills the whole session of a process started with start_new_session, e.g. perf and its decoder
+    if group:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    elif hasattr(os, "wait4"):
+        # Popen.kill() polls first and may reap the child, which would lose its rusage
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+
+def popen(cmd, cpus=None, **kwargs):
+    # Popen with the child confined to cpus from its first instruction: the mask is set on the
+    # forking thread only, for the duration of the fork, and a child inherits its forking thread's mask
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return subprocess.Popen(cmd, **kwargs)
+    old = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cpus)
+    try:
+        return subprocess.Popen(cmd, **kwargs)
+    finally:
+        os.sched_setaffinity(0, old)
+
+def pin(process, cpus):
+    # for a process that is already running and idle, e.g. an avworker between clips,
+    # only its main thread changes, the threads it starts afterwards inherit it
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(process.pid, cpus)
+    except ProcessLookupError:
+        pass
+
+def usage_dict(ru, wall):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    maxrss = ru.ru_maxrss // 1024 if sys.platform == "darwin" else ru.ru_maxrss
+    return {
+        "wall": wall,
+        "user": ru.ru_utime,
+        "sys": ru.ru_stime,
+        "maxrss_kb": maxrss,
+        "nvcsw": ru.ru_nvcsw,
+        "nivcsw": ru.ru_nivcsw,
+    }
+
+def wait(process, start):
+    # reaps process, returns (returncode, usage), usage is None where wait4 is not available
+    if not hasattr(os, "wait4"):
+        return process.wait(), None
+    try:
+        _, status, ru = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage_dict(ru, time.monotonic() - start)
+
+class Watchdog:
+    # kills process after timeout seconds unless cancelled first
+    def __init__(self, process, timeout, group=False):
+        self.fired = threading.Event()
+        def fire():
+            self.fired.set()
+            kill(process, group)
+        self.__timer = threading.Timer(timeout, fire)
+        self.__timer.start()
+
+    def cancel(self):
+        self.__timer.cancel()
+
+def run(cmd, timeout, cpus=None, group=False):
+    # like subprocess.run(capture_output=True), plus the child's rusage. group for commands that
+    # fork the real work, a timeout then kills all of their processes and not only the first
+    start = time.monotonic()
+    process = popen(cmd, cpus, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=group)
+    out = {}
+    def reader(name, pipe):
+        out[name] = pipe.read()
+        pipe.close()
+    readers = [threading.Thread(target=reader, args=(n, p)) for n, p in (("stdout", process.stdout), ("stderr", process.stderr))]
+    for t in readers:
+        t.start()
+    watchdog = Watchdog(process, timeout, group)
+    try:
+        for t in readers:
+            t.join()
+        returncode, usage = wait(process, start)
+    finally:
+        watchdog.cancel()
+    if watchdog.fired.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return returncode, out["stdout"], out["stderr"], usage
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+from urllib.parse import urlparse
+import yaml
+
+MD5_TXT = "md5.txt"
+FRAMEMD5_DIR = "framemd5"
+FRAMEMD5_EXT = ".framemd5"
+
+def norm(path):
+    return os.path.normcase(os.path.abspath(path))
+
+def parse_framemd5_line(line):
+    # "stream, dts, pts, duration, size, hash" -> (pts, hash), None for headers
+    if line.startswith("#"):
+        return None
+    fields = [x.strip() for x in line.split(",")]
+    if len(fields) < 6:
+        return None
+    return int(fields[2]), fields[-1].lower()
+
+def parse_framemd5(text):
+    return [x for x in map(parse_framemd5_line, text.splitlines()) if x]
+
+def yaml_source(cfg_file, cfg):
+    # same naming as TestRunner.download
+    urlpath = urlparse(cfg["url"]).path
+    ext = urlpath.rsplit(".", 1)[-1] if "." in urlpath else "bit"
+    return os.path.splitext(cfg_file)[0] + "." + ext
+
+class RefIndex:
+    # every reference md5 below a path, from md5.txt lines and YAML md5: fields, parsed once
+    def __init__(self):
+        self.__md5 = {}
+        self.__origin = {}
+        self.__lines = set()
+        self.__loaded = set()
+        self.__frames = {}
+        self.duplicates = []
+        self.yaml_sources = set()
+
+    def load(self, path):
+        root = path if os.path.isdir(path) else os.path.dirname(path)
+        for dirpath, _, filenames in os.walk(root or "."):
+            if norm(dirpath) in self.__loaded:
+                continue
+            self.__loaded.add(norm(dirpath))
+            # md5.txt first, it wins over YAML md5: fields on conflict
+            for name in sorted(filenames, key=lambda n: (n != MD5_TXT, n)):
+                if name == MD5_TXT:
+                    self.__load_md5_txt(os.path.join(dirpath, name))
+                elif name.endswith(".yaml"):
+                    self.__load_yaml(os.path.join(dirpath, name))
+                elif name.endswith(FRAMEMD5_EXT) and os.path.basename(dirpath) == FRAMEMD5_DIR:
+                    clip = os.path.join(os.path.dirname(dirpath), name[:-len(FRAMEMD5_EXT)])
+                    self.__frames[norm(clip)] = os.path.join(dirpath, name)
+        return self
+
+    def __add(self, clip, md5, origin, line=False):
+        # line: origin is a md5.txt line, a YAML md5: field may repeat one of those
+        key = norm(clip)
+        md5 = md5.lower()
+        if key in self.__md5:
+            # identical lines too, that is how a double-appended md5.txt shows
+            if self.__md5[key] != md5 or (line and key in self.__lines):
+                self.duplicates.append((clip, self.__md5[key], md5, self.__origin[key], origin))
+            return
+        if line:
+            self.__lines.add(key)
+        self.__md5[key] = md5
+        self.__origin[key] = origin
+
+    def __load_md5_txt(self, file):
+        dir = os.path.dirname(file)
+        with open(file, "r") as f:
+            for i, line in enumerate(f, 1):
+                pair = line.split(None, 1)
+                if len(pair) == 2:
+                    self.__add(os.path.join(dir, pair[1].strip()), pair[0], "%s:%d" % (file, i), True)
+
+    def __load_yaml(self, file):
+        with open(file, "r") as f:
+            cfg = yaml.safe_load(f)
+        if not isinstance(cfg, dict) or "url" not in cfg:
+            return
+        src = yaml_source(file, cfg)
+        self.yaml_sources.add(norm(src))
+        if cfg.get("md5"):
+            self.__add(src, cfg["md5"], file)
+
+    def get(self, clip):
+        return self.__md5.get(norm(clip))
+
+    def get_frames(self, clip):
+        # [(pts, md5)] in output order, None if the clip has no framemd5 reference
+        path = self.__frames.get(norm(clip))
+        if path is None:
+            return None
+        with open(path, "r") as f:
+            return parse_framemd5(f.read())
+
+    def entries(self, dir):
+        # {basename: md5} for one directory, the layout of a md5.txt
+        dir = norm(dir)
+        return {os.path.basename(k): v for k, v in self.__md5.items() if os.path.dirname(k) == dir}
+
+    def orphan_refs(self):
+        # md5 lines whose clip is neither on disk nor fetchable from a YAML
+        return sorted((k for k in self.__md5 if not os.path.exists(k) and k not in self.yaml_sources),
+                      key=lambda k: self.__origin[k])
+
+    def missing_refs(self, clips):
+        return [c for c in clips if norm(c) not in self.__md5]
+
+    def report(self, clips=None):
+        for clip, old, new, old_origin, new_origin in self.duplicates:
+            if old == new:
+                print("warning: repeated md5 for %s: %s (%s and %s)" % (clip, old, old_origin, new_origin))
+            else:
+                print("duplicate md5 for %s: %s (%s) vs %s (%s)" % (clip, old, old_origin, new, new_origin))
+        orphans = {}
+        for k in self.orphan_refs():
+            orphans.setdefault(self.__origin[k].rsplit(":", 1)[0], []).append(os.path.basename(k))
+        for origin, names in orphans.items():
+            print("%s: %d entries without a clip, e.g. %s" % (origin, len(names), names[0]))
+        for clip in self.missing_refs(clips or []):
+            print("no ref md5 for " + clip)
@@ -21,12 +21,24 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
-import hashlib
+import concurrent.futures
 import os
 from urllib.parse import urlparse
-import urllib.request
 import yaml
-import tqdm
+from utils.cache import Md5Cache, default_cache_dir
+from utils.download import fetch
+from utils.store import ClipStore
+
+# concurrent source downloads, FFVVC_DOWNLOAD_JOBS overrides
+DOWNLOAD_JOBS = int(os.getenv("FFVVC_DOWNLOAD_JOBS", "4"))
+# concurrent md5 checks of sources already on disk, FFVVC_VERIFY_JOBS overrides
+VERIFY_JOBS = int(os.getenv("FFVVC_VERIFY_JOBS", "4"))
+
+class SourceError(Exception):
+    # a source that could not be downloaded or verified, path is the clip or its yaml
+    def __init__(self, path, message):
+        super().__init__(message)
+        self.path = path
 
 class TestRunner:
     SUPPORTED_EXTENSIONS = [".bin", ".bit", ".vvc", ".266", ".ts"]
@@ -39,12 +51,25 @@ class TestRunner:
             "-f",
             "--ffmpeg-path",
             type=str,
-            default=(os.getenv("FFMPEG_PATH") if os.getenv("FFMPEG_PATH") else None),
+            action="append",
+            help="may be given more than once where a runner compares binaries, the first one is the baseline",
         )
+        parser.add_argument("--download-jobs", type=int, default=DOWNLOAD_JOBS, help="concurrent source downloads")
+        parser.add_argument("--verify-jobs", type=int, default=VERIFY_JOBS, help="concurrent md5 checks of sources already on disk")
+        parser.add_argument("--timeout-scale", type=float, default=10.0,
+                            help="a decode times out after this many times its expected duration, from history or stream headers")
+        parser.add_argument("--min-timeout", type=float, default=30.0, help="seconds, the shortest timeout any clip gets")
+        parser.add_argument("--rehash", action="store_true", help="hash every source again instead of trusting the md5s remembered from earlier runs")
 
         self.add_args(parser)
 
         self.args = parser.parse_args()
+        if not self.args.ffmpeg_path and os.getenv("FFMPEG_PATH"):
+            self.args.ffmpeg_path = [os.getenv("FFMPEG_PATH")]
+        self.args.ffmpeg_paths = self.args.ffmpeg_path or []
+        self.args.ffmpeg_path = self.args.ffmpeg_paths[0] if self.args.ffmpeg_paths else None
+        # md5s of unchanged files are remembered across runs, next to the runner's other caches
+        self.__md5s = Md5Cache(getattr(self.args, "cache_dir", None) or default_cache_dir(), self.args.rehash)
 
         not_vvdec = hasattr(self.args, "vvdec_path") and not self.args.vvdec_path
         if  not_vvdec and not self.args.vvdec_path and not self.args.ffmpeg_path:
@@ -66,19 +91,22 @@ class TestRunner:
             raise FileNotFoundError(f"No corresponding config YAML file {cfg_file} found for source file {file}")
         return cfg
 
-    @staticmethod
-    def get_md5(file):
-        md5 = hashlib.md5()
-        with open(file, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5.update(chunk)
-        return md5.hexdigest()
+    def get_md5(self, file):
+        return self.__md5s.md5(file)
 
-    @staticmethod
-    def check_src_md5(file):
+    def save_md5s(self):
+        self.__md5s.save()
+
+    def check_src_md5(self, file):
         cfg = TestRunner.get_cfg(file)
         md5 = cfg["src_md5"]
-        return md5 == TestRunner.get_md5(file)
+        if md5 != self.get_md5(file):
+            return False
+        # a checkout that already has the clip still counts as a use of the store's copy
+        store = ClipStore.from_env()
+        if store:
+            store.touch(md5)
+        return True
 
     @staticmethod
     def child_files(path):
@@ -101,37 +129,100 @@ class TestRunner:
         return ext in supported
 
     @staticmethod
-    def list_files(path):
-        TestRunner.update_files(path)
+    def list_clips(path):
+        # one entry per clip under path, without fetching or reading anything:
+        # the file itself, or the yaml where the clip is a source to download
+        children = TestRunner.child_files(path)
+        bases = set(os.path.splitext(f)[0] for f in children if f.endswith(".yaml"))
+        return sorted([f for f in children if TestRunner.is_candidiate(f) and os.path.splitext(f)[0] not in bases] +
+                      [base + ".yaml" for base in bases])
+
+    def list_files(self, path):
+        self.update_files(path)
         return [f for f in TestRunner.child_files(path) if TestRunner.is_candidiate(f)]
 
     @staticmethod
-    def download(file):
+    def source_path(file):
+        # where download() puts the source of file.yaml
         cfg = TestRunner.get_cfg(file)
-        url = cfg["url"]
-        urlpath = urlparse(url).path
+        urlpath = urlparse(cfg["url"]).path
         ext = urlpath.rsplit(".", 1)[-1] if "." in urlpath else "bit"
-        dest = file + "." + ext
-        pbar = tqdm.tqdm(desc=f"Downloading {dest}",
-                         unit="B", unit_scale=True, miniters=1, dynamic_ncols=True)
-        def update_bar(blocknum, blocksize, totalsize):
-            pbar.total = totalsize
-            pbar.update(blocknum * blocksize - pbar.n)
-        filename, headers = urllib.request.urlretrieve(url, dest, reporthook=update_bar)
-        return filename
+        return file + "." + ext
+
+    def download(self, file):
+        # verified against src_md5 while it streams in, raises DownloadError on mismatch
+        cfg = TestRunner.get_cfg(file)
+        dest = TestRunner.source_path(file)
+        store = ClipStore.from_env()
+        if store:
+            store.get(cfg["src_md5"], dest, lambda obj: fetch(cfg["url"], obj, cfg["src_md5"], desc=dest))
+        else:
+            fetch(cfg["url"], dest, cfg["src_md5"])
+        self.__md5s.put(dest, cfg["src_md5"])
+        return dest
 
     @staticmethod
-    def update_files(path):
-        files = [f for f in TestRunner.child_files(path) if f.endswith(".yaml")]
-        files = [os.path.splitext(f)[0] for f in files]
-
-        for f in files:
-            for ext in TestRunner.SUPPORTED_EXTENSIONS:
-                if os.path.isfile(f + ext):
-                    src = f + ext
-                    break
+    def __local_source(base):
+        for ext in TestRunner.SUPPORTED_EXTENSIONS:
+            if os.path.isfile(base + ext):
+                return base + ext
+        return None
+
+    def stream_files(self, path, jobs=DOWNLOAD_JOBS, verify_jobs=VERIFY_JOBS, key=None):
+        # yields the candidate files under path as they become usable, so tests can start before
+        # the rest is downloaded: files without a yaml right away, yaml sources on disk once their
+        # md5 is checked, missing ones once downloaded and verified. each batch that becomes usable
+        # together is yielded in key order. raises SourceError for the first source that fails.
+        # path may also be a list from list_clips(), e.g. one shard of it
+        children = path if isinstance(path, list) else TestRunner.child_files(path)
+        bases = sorted(set(os.path.splitext(f)[0] for f in children if f.endswith(".yaml")))
+        yield from sorted((f for f in children if TestRunner.is_candidiate(f) and os.path.splitext(f)[0] not in bases),
+                          key=key)
+
+        local = {}
+        missing = []
+        for base in bases:
+            src = TestRunner.__local_source(base)
+            if src:
+                local[src] = base
             else:
-                src = TestRunner.download(f)
+                missing.append(base)
 
-            if not TestRunner.check_src_md5(src):
-                raise Exception(f"Source MD5 mismatch for {src}")
+        verifier = concurrent.futures.ThreadPoolExecutor(max_workers=verify_jobs)
+        downloader = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        try:
+            # future -> (source or yaml, downloading)
+            pending = {}
+            for base in missing:
+                pending[downloader.submit(self.download, base)] = (base + ".yaml", True)
+            for src in sorted(local, key=key):
+                pending[verifier.submit(self.check_src_md5, src)] = (src, False)
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                batch = []
+                error = None
+                for future in done:
+                    src, downloading = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        error = error or SourceError(src, f"Source download failed for {src}: {e}")
+                        continue
+                    if downloading:
+                        batch.append(result)
+                    elif result:
+                        batch.append(src)
+                    else:
+                        error = error or SourceError(src, f"Source MD5 mismatch for {src}")
+                yield from sorted(batch, key=key)
+                if error:
+                    raise error
+        finally:
+            # on an error, or a consumer that stops early, do not wait for the remaining downloads
+            verifier.shutdown(cancel_futures=True)
+            downloader.shutdown(cancel_futures=True)
+            self.save_md5s()
+
+    def update_files(self, path, jobs=DOWNLOAD_JOBS):
+        for f in self.stream_files(path, jobs):
+            pass
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+def amdahl_serial_fraction(speedups):
+    # least squares fit of 1/S(n) = f + (1 - f) / n, i.e. 1/S - 1/n = f * (1 - 1/n)
+    num = den = 0.0
+    for n, s in speedups.items():
+        if n <= 1 or s <= 0:
+            continue
+        x = 1.0 / n
+        num += (1 - x) * (1 / s - x)
+        den += (1 - x) ** 2
+    return min(1.0, max(0.0, num / den)) if den else None
+
+def knee(fps, min_gain=0.05):
+    # the last thread count whose next step still paid off by min_gain, i.e. where scaling stops
+    counts = sorted(fps)
+    for a, b in zip(counts, counts[1:]):
+        if fps[b] < fps[a] * (1 + min_gain):
+            return a
+    return counts[-1]
+
+def analyze(fps, min_gain=0.05):
+    # fps: {threads: median fps}, speedup and efficiency are relative to 1 thread (or the smallest count)
+    base_n = min(fps)
+    base = fps[base_n] / base_n
+    rows = []
+    speedups = {}
+    for n in sorted(fps):
+        s = fps[n] / base
+        speedups[n] = s
+        rows.append({"threads": n, "fps": fps[n], "speedup": s, "efficiency": s / n})
+    return {
+        "points": rows,
+        "serial_fraction": amdahl_serial_fraction(speedups),
+        "knee": knee(fps, min_gain),
+    }
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+
+def parse_shard(s):
+    k, n = (int(x) for x in s.split("/"))
+    if not 1 <= k <= n:
+        raise ValueError("invalid shard %s, expected K/N with 1 <= K <= N" % s)
+    return k, n
+
+def split(files, n, cost):
+    # greedy longest-first partition, deterministic as long as every shard sees the same files and costs
+    shards = [[] for _ in range(n)]
+    loads = [0.0] * n
+    for f in sorted(files, key=lambda f: (-cost(f), os.path.normpath(f))):
+        i = min(range(n), key=lambda i: (loads[i], i))
+        shards[i].append(f)
+        loads[i] += cost(f)
+    return shards
+
+def write_results(path, shard, results, usage={}):
+    # results: [(file, status name)], usage: {file: rusage dict} for the clips that were decoded
+    entries = []
+    for file, status in sorted(results):
+        e = {"file": os.path.normpath(file), "status": status, "size": os.stat(file).st_size}
+        if file in usage:
+            e["usage"] = usage[file]
+        entries.append(e)
+    with open(path, "w") as f:
+        json.dump({"shard": "%d/%d" % shard if shard else "1/1", "results": entries}, f, indent=1)
+
+def read_results(paths):
+    shards = {}
+    results = []
+    total = None
+    for path in paths:
+        with open(path, "r") as f:
+            data = json.load(f)
+        k, n = parse_shard(data["shard"])
+        if total not in (None, n):
+            raise Exception("%s is shard %d/%d, other files are out of %d" % (path, k, n, total))
+        total = n
+        if k in shards:
+            raise Exception("shard %d/%d given twice: %s and %s" % (k, n, shards[k], path))
+        shards[k] = path
+        results += data["results"]
+    missing = [k for k in range(1, n + 1) if k not in shards]
+    if missing:
+        raise Exception("missing shard result files for %s of %d" % (", ".join(map(str, missing)), n))
+    return results
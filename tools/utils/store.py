@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import contextlib
+import errno
+import os
+import re
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+
+def parse_size(s):
+    # "50G", "800M", "1073741824"
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", s, re.IGNORECASE)
+    if not m:
+        raise ValueError("invalid size " + s)
+    return int(float(m.group(1)) * 1024 ** " KMGT".index(m.group(2).upper() or " "))
+
+@contextlib.contextmanager
+def locked(path):
+    # exclusive flock on path, a no-op where fcntl does not exist
+    with open(path, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def materialize(src, dest):
+    # hardlink, else reflink, else copy
+    tmp = dest + ".%d.tmp" % os.getpid()
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            with open(src, "rb") as s, open(tmp, "wb") as d:
+                if not fcntl:
+                    raise OSError(errno.ENOTSUP, "no reflink")
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+class ClipStore:
+    # content addressed by src_md5 and shared between checkouts on one host, LRU-evicted above max_size
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "locks"), exist_ok=True)
+
+    @staticmethod
+    def from_env():
+        root = os.getenv("FFVVC_CLIP_STORE")
+        if not root:
+            return None
+        max_size = os.getenv("FFVVC_CLIP_STORE_MAX")
+        return ClipStore(root, parse_size(max_size) if max_size else None)
+
+    def object_path(self, md5):
+        return os.path.join(self.root, "objects", md5[:2], md5)
+
+    def used_path(self, md5):
+        # the LRU clock, a file of its own: the object's mtime is shared with every hardlinked checkout
+        return os.path.join(self.root, "locks", md5 + ".used")
+
+    def touch(self, md5):
+        # marks the object as used, on every lookup whether or not it is materialized
+        if not os.path.exists(self.object_path(md5)):
+            return
+        with open(self.used_path(md5), "a"):
+            pass
+        os.utime(self.used_path(md5))
+
+    def last_used(self, md5, path):
+        try:
+            return os.stat(self.used_path(md5)).st_mtime
+        except FileNotFoundError:
+            return os.stat(path).st_mtime
+
+    def get(self, md5, dest, fetch):
+        # puts the clip with this md5 at dest, calling fetch(path) to download it into the store if needed
+        obj = self.object_path(md5)
+        fetched = False
+        with locked(os.path.join(self.root, "locks", md5 + ".lock")):
+            if not os.path.exists(obj):
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                # fetch verifies the md5 and renames into place only when complete
+                fetch(obj)
+                fetched = True
+            self.touch(md5)
+            materialize(obj, dest)
+        # outside the object lock, evict() takes other objects' locks
+        if fetched:
+            self.evict(keep=obj)
+        return dest
+
+    def objects(self):
+        objs = []
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, "objects")):
+            for name in filenames:
+                if re.fullmatch(r"[0-9a-f]{32}", name):
+                    path = os.path.join(dirpath, name)
+                    objs.append((self.last_used(name, path), os.stat(path).st_size, path))
+        return objs
+
+    def evict(self, keep=None):
+        # hardlinked checkouts keep their data, eviction only drops the store's reference
+        if self.max_size is None:
+            return
+        with locked(os.path.join(self.root, "locks", "evict.lock")):
+            objs = sorted(self.objects())
+            total = sum(size for _, size, _ in objs)
+            for mtime, size, path in objs:
+                if total <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                md5 = os.path.basename(path)
+                with locked(os.path.join(self.root, "locks", md5 + ".lock")):
+                    for p in (path, self.used_path(md5)):
+                        try:
+                            os.remove(p)
+                        except FileNotFoundError:
+                            pass
+                total -= size
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import threading
+from utils import vvc
+from utils.cache import merge_by_stat, stat_key, write_json
+
+class ToolIndex:
+    # clip_info() per (device, inode, size, mtime), only new or changed clips are parsed again
+    VERSION = 2
+
+    def __init__(self, dir):
+        self.__path = os.path.join(dir, "tools.json")
+        self.__lock = threading.Lock()
+        self.__entries = self.__load()
+        self.__dirty = False
+
+    def __load(self):
+        try:
+            with open(self.__path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                return data["entries"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return {}
+
+    def info(self, path):
+        key = stat_key(os.stat(path))
+        with self.__lock:
+            e = self.__entries.get(key)
+        if e is not None:
+            return e["info"]
+        info = vvc.clip_info(path)
+        with self.__lock:
+            self.__entries[key] = {"info": info, "path": os.path.abspath(path)}
+            self.__dirty = True
+        return info
+
+    def save(self):
+        with self.__lock:
+            if not self.__dirty:
+                return
+            entries = merge_by_stat(self.__load(), self.__entries)
+            write_json(self.__path, {"version": self.VERSION, "entries": entries})
+            self.__entries = entries
+            self.__dirty = False
+
+INDEXES = {}
+
+def get_index(dir):
+    # one per cache dir, shared by the clip selector and the cost model, however the dir is spelled
+    dir = os.path.realpath(dir)
+    if dir not in INDEXES:
+        INDEXES[dir] = ToolIndex(dir)
+    return INDEXES[dir]
+
+def parse_list(s, cast=str):
+    return [cast(x) for x in s.split(",") if x] if s else []
+
+class ClipSelector:
+    # keeps the clips whose parameter sets enable every --tools entry and match --chroma/--bit-depth/--profile
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("--tools", type=str, default=None,
+                            help="comma separated, only run clips that use all of them: " + ",".join(vvc.TOOLS))
+        parser.add_argument("--chroma", type=str, default=None, help="comma separated chroma formats, e.g. 420,444")
+        parser.add_argument("--bit-depth", type=str, default=None, help="comma separated luma bit depths, e.g. 10,12")
+        parser.add_argument("--profile", type=str, default=None, help="comma separated general_profile_idc values")
+
+    @staticmethod
+    def from_args(args, cache_dir):
+        # None when no selector was given
+        tools = parse_list(args.tools)
+        unknown = [t for t in tools if t not in vvc.TOOLS]
+        if unknown:
+            raise Exception("unknown --tools " + ",".join(unknown) + ", known: " + ",".join(vvc.TOOLS))
+        chroma = parse_list(args.chroma, int)
+        bad = [c for c in chroma if c not in vvc.CHROMA_FORMATS.values()]
+        if bad:
+            raise Exception("unknown --chroma %s, known: 400,420,422,444" % ",".join(map(str, bad)))
+        depth = parse_list(args.bit_depth, int)
+        profile = parse_list(args.profile, int)
+        if not (tools or chroma or depth or profile):
+            return None
+        return ClipSelector(get_index(cache_dir), tools, chroma, depth, profile)
+
+    def __init__(self, index, tools, chroma, depth, profile):
+        self.index = index
+        self.__tools = set(tools)
+        self.__chroma = set(chroma)
+        self.__depth = set(depth)
+        self.__profile = set(profile)
+
+    def matches(self, path):
+        info = self.index.info(path)
+        if not self.__tools <= set(info["tools"]):
+            return False
+        if self.__chroma and not self.__chroma & set(info["chroma"]):
+            return False
+        if self.__depth and not self.__depth & set(info["bit_depth"]):
+            return False
+        if self.__profile and info["profile"] not in self.__profile:
+            return False
+        return True
+
+    def select(self, files):
+        # keeps a list a list, and a stream a stream
+        if isinstance(files, list):
+            return [f for f in files if self.matches(f)]
+        return (f for f in files if self.matches(f))
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# just enough of H.266 to tell which coding tools a clip enables: NAL units, VPS layers, SPS, the start of
+# the PPS and APS types. everything after sps_virtual_boundaries_enabled_flag is left unparsed
+import os
+
+NAL_GDR = 10
+NAL_MAX_VCL = 11
+NAL_PH = 19
+NAL_SPS = 15
+NAL_PPS = 16
+NAL_PREFIX_APS = 17
+NAL_SUFFIX_APS = 18
+
+APS_TYPES = {0: "alf", 1: "lmcs", 2: "scaling_list"}
+
+CHROMA_FORMATS = {0: 400, 1: 420, 2: 422, 3: 444}
+
+PROFILES = {
+    1: "Main 10", 17: "Multilayer Main 10", 33: "Main 10 4:4:4", 49: "Multilayer Main 10 4:4:4",
+    65: "Main 10 Still Picture", 97: "Main 10 4:4:4 Still Picture", 2: "Main 12", 34: "Main 12 4:4:4",
+    35: "Main 16 4:4:4", 10: "Main 12 Intra", 42: "Main 12 4:4:4 Intra", 43: "Main 16 4:4:4 Intra",
+    66: "Main 12 Still Picture", 98: "Main 12 4:4:4 Still Picture", 99: "Main 16 4:4:4 Still Picture",
+}
+
+# tool name -> sps flag
+SPS_TOOLS = {
+    "subpic": "sps_subpic_info_present_flag",
+    "res_change": "sps_res_change_in_clvs_allowed_flag",
+    "wpp": "sps_entropy_coding_sync_enabled_flag",
+    "dual_tree": "sps_qtbtt_dual_tree_intra_flag",
+    "transform_skip": "sps_transform_skip_enabled_flag",
+    "bdpcm": "sps_bdpcm_enabled_flag",
+    "mts": "sps_mts_enabled_flag",
+    "lfnst": "sps_lfnst_enabled_flag",
+    "joint_cbcr": "sps_joint_cbcr_enabled_flag",
+    "sao": "sps_sao_enabled_flag",
+    "alf": "sps_alf_enabled_flag",
+    "ccalf": "sps_ccalf_enabled_flag",
+    "lmcs": "sps_lmcs_enabled_flag",
+    "weighted_pred": "sps_weighted_pred_flag",
+    "weighted_bipred": "sps_weighted_bipred_flag",
+    "ltrp": "sps_long_term_ref_pics_flag",
+    "inter_layer": "sps_inter_layer_prediction_enabled_flag",
+    "wraparound": "sps_ref_wraparound_enabled_flag",
+    "tmvp": "sps_temporal_mvp_enabled_flag",
+    "sbtmvp": "sps_sbtmvp_enabled_flag",
+    "amvr": "sps_amvr_enabled_flag",
+    "bdof": "sps_bdof_enabled_flag",
+    "smvd": "sps_smvd_enabled_flag",
+    "dmvr": "sps_dmvr_enabled_flag",
+    "mmvd": "sps_mmvd_enabled_flag",
+    "sbt": "sps_sbt_enabled_flag",
+    "affine": "sps_affine_enabled_flag",
+    "prof": "sps_affine_prof_enabled_flag",
+    "bcw": "sps_bcw_enabled_flag",
+    "ciip": "sps_ciip_enabled_flag",
+    "gpm": "sps_gpm_enabled_flag",
+    "isp": "sps_isp_enabled_flag",
+    "mrl": "sps_mrl_enabled_flag",
+    "mip": "sps_mip_enabled_flag",
+    "cclm": "sps_cclm_enabled_flag",
+    "palette": "sps_palette_enabled_flag",
+    "act": "sps_act_enabled_flag",
+    "ibc": "sps_ibc_enabled_flag",
+    "ladf": "sps_ladf_enabled_flag",
+    "scaling_list": "sps_explicit_scaling_list_enabled_flag",
+    "dep_quant": "sps_dep_quant_enabled_flag",
+    "sign_hiding": "sps_sign_data_hiding_enabled_flag",
+    "virtual_boundaries": "sps_virtual_boundaries_enabled_flag",
+}
+
+# tools that show in the stream rather than as an sps flag. encoders leave rpr and gdr enabled in
+# most sps, so those two mean pictures that actually change size and gdr pictures
+OTHER_TOOLS = ["tiles", "mixed_nalu", "scaling_window", "multilayer", "rpr", "gdr"]
+
+TOOLS = sorted(set(SPS_TOOLS) | set(OTHER_TOOLS))
+
+# multi-GB transport streams repeat their parameter sets, the start of them is enough
+MAX_SCAN = 64 << 20
+
+class BitReader:
+    def __init__(self, data):
+        self.__bits = len(data) * 8
+        self.__value = int.from_bytes(data, "big")
+        self.pos = 0
+
+    def u(self, n):
+        if n == 0:
+            return 0
+        if self.pos + n > self.__bits:
+            raise EOFError("read past the end of the NAL unit")
+        self.pos += n
+        return (self.__value >> (self.__bits - self.pos)) & ((1 << n) - 1)
+
+    def ue(self):
+        zeros = 0
+        while not self.u(1):
+            zeros += 1
+            if zeros > 32:
+                raise ValueError("invalid exp-golomb code")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        k = self.ue()
+        return (k + 1) // 2 if k & 1 else -(k // 2)
+
+    def byte_align(self):
+        self.u(-self.pos % 8)
+
+def ceil_log2(x):
+    return (x - 1).bit_length() if x > 1 else 0
+
+def rbsp(payload):
+    # drops emulation prevention bytes
+    return payload.replace(b"\x00\x00\x03", b"\x00\x00")
+
+def nal_units(data):
+    # (nal_unit_type, nuh_layer_id, payload after the 2 byte header) for an Annex B byte stream
+    start = data.find(b"\x00\x00\x01")
+    while start >= 0:
+        begin = start + 3
+        end = data.find(b"\x00\x00\x01", begin)
+        nal = data[begin:] if end < 0 else data[begin:end]
+        nal = nal.rstrip(b"\x00")
+        if len(nal) >= 2:
+            yield nal[1] >> 3, nal[0] & 0x3F, nal[2:]
+        start = end
+
+def ts_video(data):
+    # the first video PES stream of an MPEG-TS, as one byte string
+    pid = None
+    out = []
+    for off in range(0, len(data) - 187, 188):
+        pkt = data[off:off + 188]
+        if pkt[0] != 0x47:
+            continue
+        p = (pkt[1] & 0x1F) << 8 | pkt[2]
+        afc = (pkt[3] >> 4) & 3
+        if not afc & 1:
+            continue
+        pos = 4 + (1 + pkt[4] if afc & 2 else 0)
+        if pkt[1] & 0x40:
+            pes = pkt[pos:]
+            if pes[:3] == b"\x00\x00\x01" and 0xE0 <= pes[3] <= 0xEF and len(pes) > 8:
+                if pid is None:
+                    pid = p
+                if p == pid:
+                    pos += 9 + pes[8]
+        if p == pid and pos < 188:
+            out.append(pkt[pos:])
+    return b"".join(out)
+
+def profile_tier_level(r, sps, max_sublayers_minus1):
+    sps["general_profile_idc"] = r.u(7)
+    r.u(1)  # general_tier_flag
+    sps["general_level_idc"] = r.u(8)
+    r.u(1)  # ptl_frame_only_constraint_flag
+    sps["ptl_multilayer_enabled_flag"] = r.u(1)
+    # general_constraints_info()
+    if r.u(1):
+        r.u(70)
+        r.u(r.u(8))  # gci_num_additional_bits
+    r.byte_align()
+    present = [r.u(1) for _ in range(max_sublayers_minus1)]
+    r.byte_align()
+    for p in present:
+        if p:
+            r.u(8)  # sublayer_level_idc
+    for _ in range(r.u(8)):
+        r.u(32)  # general_sub_profile_idc
+
+def ref_pic_list_struct(r, sps, list_idx, rpls_idx):
+    num_entries = r.ue()
+    ltrp_in_header = 0
+    if sps["sps_long_term_ref_pics_flag"] and rpls_idx < sps["sps_num_ref_pic_lists"][list_idx] and num_entries > 0:
+        ltrp_in_header = r.u(1)
+    for i in range(num_entries):
+        inter_layer = r.u(1) if sps.get("sps_inter_layer_prediction_enabled_flag") else 0
+        if inter_layer:
+            r.ue()  # ilrp_idx
+            continue
+        st = r.u(1) if sps["sps_long_term_ref_pics_flag"] else 1
+        if st:
+            abs_delta = r.ue()
+            if not ((sps["sps_weighted_pred_flag"] or sps["sps_weighted_bipred_flag"]) and i != 0):
+                abs_delta += 1
+            if abs_delta:
+                r.u(1)  # strp_entry_sign_flag
+        elif not ltrp_in_header:
+            r.u(sps["sps_log2_max_pic_order_cnt_lsb_minus4"] + 4)
+
+def parse_sps(payload, sps):
+    # fills sps as it goes, so a truncated or corrupt sps still gives its leading fields
+    r = BitReader(rbsp(payload))
+    f = lambda name, v: sps.__setitem__(name, v) or v
+    r.u(4)  # sps_seq_parameter_set_id
+    f("sps_video_parameter_set_id", r.u(4))
+    max_sub = f("sps_max_sublayers_minus1", r.u(3))
+    chroma = f("sps_chroma_format_idc", r.u(2))
+    ctb = 1 << (f("sps_log2_ctu_size_minus5", r.u(2)) + 5)
+    ptl = r.u(1)
+    if ptl:
+        profile_tier_level(r, sps, max_sub)
+    f("sps_gdr_enabled_flag", r.u(1))
+    if f("sps_ref_pic_resampling_enabled_flag", r.u(1)):
+        f("sps_res_change_in_clvs_allowed_flag", r.u(1))
+    w = f("sps_pic_width_max_in_luma_samples", r.ue())
+    h = f("sps_pic_height_max_in_luma_samples", r.ue())
+    if r.u(1):
+        for _ in range(4):
+            r.ue()
+    if f("sps_subpic_info_present_flag", r.u(1)):
+        n = r.ue()
+        independent, same_size = 1, 0
+        if n > 0:
+            independent, same_size = r.u(1), r.u(1)
+        wbits = ceil_log2((w + ctb - 1) // ctb)
+        hbits = ceil_log2((h + ctb - 1) // ctb)
+        for i in range(n + 1 if n > 0 else 0):
+            if not same_size or i == 0:
+                if i > 0 and w > ctb:
+                    r.u(wbits)
+                if i > 0 and h > ctb:
+                    r.u(hbits)
+                if i < n and w > ctb:
+                    r.u(wbits)
+                if i < n and h > ctb:
+                    r.u(hbits)
+            if not independent:
+                r.u(2)
+        id_len = r.ue() + 1
+        if r.u(1) and r.u(1):
+            for _ in range(n + 1):
+                r.u(id_len)
+    f("sps_bitdepth_minus8", r.ue())
+    f("sps_entropy_coding_sync_enabled_flag", r.u(1))
+    r.u(1)  # sps_entry_point_offsets_present_flag
+    f("sps_log2_max_pic_order_cnt_lsb_minus4", r.u(4))
+    if r.u(1):
+        r.ue()
+    r.u(r.u(2) * 8)  # sps_extra_ph_bit_present_flag
+    r.u(r.u(2) * 8)  # sps_extra_sh_bit_present_flag
+    if ptl:
+        sublayer_info = r.u(1) if max_sub > 0 else 0
+        for _ in range(max_sub + 1 if sublayer_info else 1):
+            f("dpb_max_dec_pic_buffering", r.ue() + 1)
+            r.ue(), r.ue()
+    r.ue()  # sps_log2_min_luma_coding_block_size_minus2
+    r.u(1)  # sps_partition_constraints_override_enabled_flag
+    r.ue()
+    if r.ue():
+        r.ue(), r.ue()
+    if chroma != 0 and f("sps_qtbtt_dual_tree_intra_flag", r.u(1)):
+        r.ue()
+        if r.ue():
+            r.ue(), r.ue()
+    r.ue()
+    if r.ue():
+        r.ue(), r.ue()
+    tr64 = r.u(1) if ctb > 32 else 0
+    if f("sps_transform_skip_enabled_flag", r.u(1)):
+        r.ue()
+        f("sps_bdpcm_enabled_flag", r.u(1))
+    if f("sps_mts_enabled_flag", r.u(1)):
+        r.u(2)
+    f("sps_lfnst_enabled_flag", r.u(1))
+    if chroma != 0:
+        jcbcr = f("sps_joint_cbcr_enabled_flag", r.u(1))
+        same = r.u(1)
+        for _ in range(1 if same else 3 if jcbcr else 2):
+            r.se()
+            for _ in range(r.ue() + 1):
+                r.ue(), r.ue()
+    f("sps_sao_enabled_flag", r.u(1))
+    if f("sps_alf_enabled_flag", r.u(1)) and chroma != 0:
+        f("sps_ccalf_enabled_flag", r.u(1))
+    f("sps_lmcs_enabled_flag", r.u(1))
+    f("sps_weighted_pred_flag", r.u(1))
+    f("sps_weighted_bipred_flag", r.u(1))
+    f("sps_long_term_ref_pics_flag", r.u(1))
+    if sps["sps_video_parameter_set_id"] > 0:
+        f("sps_inter_layer_prediction_enabled_flag", r.u(1))
+    r.u(1)  # sps_idr_rpl_present_flag
+    rpl1_same = r.u(1)
+    sps["sps_num_ref_pic_lists"] = [0, 0]
+    for i in range(1 if rpl1_same else 2):
+        sps["sps_num_ref_pic_lists"][i] = r.ue()
+        for j in range(sps["sps_num_ref_pic_lists"][i]):
+            ref_pic_list_struct(r, sps, i, j)
+    f("sps_ref_wraparound_enabled_flag", r.u(1))
+    if f("sps_temporal_mvp_enabled_flag", r.u(1)):
+        f("sps_sbtmvp_enabled_flag", r.u(1))
+    amvr = f("sps_amvr_enabled_flag", r.u(1))
+    if f("sps_bdof_enabled_flag", r.u(1)):
+        r.u(1)
+    f("sps_smvd_enabled_flag", r.u(1))
+    if f("sps_dmvr_enabled_flag", r.u(1)):
+        r.u(1)
+    if f("sps_mmvd_enabled_flag", r.u(1)):
+        r.u(1)
+    max_merge = 6 - r.ue()
+    f("sps_sbt_enabled_flag", r.u(1))
+    if f("sps_affine_enabled_flag", r.u(1)):
+        r.ue()
+        r.u(1)
+        if amvr:
+            r.u(1)
+        if f("sps_affine_prof_enabled_flag", r.u(1)):
+            r.u(1)
+    f("sps_bcw_enabled_flag", r.u(1))
+    f("sps_ciip_enabled_flag", r.u(1))
+    if max_merge >= 2:
+        if f("sps_gpm_enabled_flag", r.u(1)) and max_merge >= 3:
+            r.ue()
+    r.ue()  # sps_log2_parallel_merge_level_minus2
+    f("sps_isp_enabled_flag", r.u(1))
+    f("sps_mrl_enabled_flag", r.u(1))
+    f("sps_mip_enabled_flag", r.u(1))
+    if chroma != 0:
+        f("sps_cclm_enabled_flag", r.u(1))
+    if chroma == 1:
+        r.u(2)
+    palette = f("sps_palette_enabled_flag", r.u(1))
+    act = f("sps_act_enabled_flag", r.u(1)) if chroma == 3 and not tr64 else 0
+    if sps["sps_transform_skip_enabled_flag"] or palette:
+        r.ue()
+    if f("sps_ibc_enabled_flag", r.u(1)):
+        r.ue()
+    if f("sps_ladf_enabled_flag", r.u(1)):
+        n = r.u(2)
+        r.se()
+        for _ in range(n + 1):
+            r.se(), r.ue()
+    scaling = f("sps_explicit_scaling_list_enabled_flag", r.u(1))
+    if sps["sps_lfnst_enabled_flag"] and scaling:
+        r.u(1)
+    if act and scaling and r.u(1):
+        r.u(1)
+    f("sps_dep_quant_enabled_flag", r.u(1))
+    f("sps_sign_data_hiding_enabled_flag", r.u(1))
+    f("sps_virtual_boundaries_enabled_flag", r.u(1))
+    return sps
+
+def parse_pps(payload, pps):
+    r = BitReader(rbsp(payload))
+    r.u(6)  # pps_pic_parameter_set_id
+    r.u(4)  # pps_seq_parameter_set_id
+    pps["pps_mixed_nalu_types_in_pic_flag"] = r.u(1)
+    pps["pps_pic_width_in_luma_samples"] = r.ue()
+    pps["pps_pic_height_in_luma_samples"] = r.ue()
+    if r.u(1):
+        for _ in range(4):
+            r.ue()
+    if r.u(1):
+        pps["pps_scaling_window_explicit_signalling_flag"] = 1
+        for _ in range(4):
+            r.se()
+    r.u(1)  # pps_output_flag_present_flag
+    pps["pps_no_pic_partition_flag"] = r.u(1)
+    return pps
+
+def parse_aps_type(payload):
+    return BitReader(payload[:1]).u(3)
+
+def read_stream(path, limit=MAX_SCAN):
+    # (elementary stream, fraction of the file it covers)
+    with open(path, "rb") as f:
+        data = f.read(limit)
+    size = os.stat(path).st_size
+    if path.lower().endswith(".ts"):
+        return ts_video(data), len(data) / size if size else 1.0
+    return data, len(data) / size if size else 1.0
+
+def clip_info(path):
+    # {"profile", "chroma", "bit_depth", "sizes", "frames", "dpb", "tools", "errors"} for a bitstream or
+    # transport stream, frames is extrapolated from the scanned part of longer files
+    chroma, depth, max_sizes, sizes, tools = set(), set(), set(), set(), set()
+    profile = None
+    errors = 0
+    frames = 0
+    dpb = 0
+    data, covered = read_stream(path)
+    for nal_type, layer, payload in nal_units(data):
+        if layer > 0:
+            tools.add("multilayer")
+        # a picture starts with a picture header, or a slice that carries its own
+        if nal_type == NAL_PH or (nal_type <= NAL_MAX_VCL and payload and payload[0] & 0x80):
+            frames += 1
+        if nal_type == NAL_SPS:
+            sps = {}
+            try:
+                parse_sps(payload, sps)
+            except (EOFError, ValueError):
+                errors += 1
+            if "sps_chroma_format_idc" in sps:
+                chroma.add(CHROMA_FORMATS[sps["sps_chroma_format_idc"]])
+            if "sps_bitdepth_minus8" in sps:
+                depth.add(sps["sps_bitdepth_minus8"] + 8)
+            if "sps_pic_width_max_in_luma_samples" in sps:
+                max_sizes.add((sps["sps_pic_width_max_in_luma_samples"], sps["sps_pic_height_max_in_luma_samples"]))
+            if profile is None:
+                profile = sps.get("general_profile_idc")
+            dpb = max(dpb, sps.get("dpb_max_dec_pic_buffering", 0))
+            tools.update(t for t, flag in SPS_TOOLS.items() if sps.get(flag))
+        elif nal_type == NAL_PPS:
+            pps = {}
+            try:
+                parse_pps(payload, pps)
+            except (EOFError, ValueError):
+                errors += 1
+            if "pps_pic_height_in_luma_samples" in pps:
+                sizes.add((pps["pps_pic_width_in_luma_samples"], pps["pps_pic_height_in_luma_samples"]))
+            if pps.get("pps_mixed_nalu_types_in_pic_flag"):
+                tools.add("mixed_nalu")
+            if pps.get("pps_scaling_window_explicit_signalling_flag"):
+                tools.add("scaling_window")
+            if pps.get("pps_no_pic_partition_flag") == 0:
+                tools.add("tiles")
+        elif nal_type in (NAL_PREFIX_APS, NAL_SUFFIX_APS) and payload:
+            aps_type = parse_aps_type(payload)
+            if aps_type in APS_TYPES:
+                tools.add(APS_TYPES[aps_type])
+        elif nal_type == NAL_GDR:
+            tools.add("gdr")
+    # pictures of more than one size, whatever the sps allows
+    if len(sizes) > 1:
+        tools.update(["res_change", "rpr"])
+    if "scaling_window" in tools:
+        tools.add("rpr")
+    return {
+        "profile": profile,
+        "chroma": sorted(chroma),
+        "bit_depth": sorted(depth),
+        "sizes": [list(x) for x in sorted(sizes or max_sizes)],
+        "frames": round(frames / covered) if covered else frames,
+        "dpb": dpb,
+        "tools": sorted(tools),
+        "errors": errors,
+    }